@@ -0,0 +1,922 @@
+"""
+annotation_utils.py
+
+Shared functions for reading detection annotation files
+(see format specifications at the top of visual_utils.py)
+"""
+
+import codecs
+import gzip
+import json
+import os
+import re
+import threading
+import numpy as np
+import coco_names
+from collections import OrderedDict
+
+
+#names of the class ids of the faster and openimages formats: torchvision's COCO categories, without __background__
+COCO_CLASS_NAMES = dict(enumerate(coco_names.COCO_INSTANCE_CATEGORY_NAMES[1:]))
+
+#characters that may appear between two objects of a (malformed) json list
+_OBJECT_SEPARATORS = " \t\r\n,["
+
+#a decode error this close to the end of the buffer may just be a token (number, true/false/null)
+#cut off by the chunk boundary, so more of the file is read before deciding the object is malformed
+_TRUNCATION_MARGIN = 32
+
+
+
+def _iter_json_objects(json_file, chunk_size=1 << 20, start=0, end=None):
+	"""
+	Incrementally parse a json file containing a (possibly malformed) list of objects,
+	yielding one object at a time
+
+	Only a window of roughly chunk_size bytes is held in memory.
+	Tolerates a missing [ at the beginning of the file, a trailing comma and/or a
+	missing ] at the end of the file, and a truncated last object, which is silently dropped.
+	A malformed object anywhere else raises a ValueError rather than dropping the rest of the file
+
+	start, end: optional byte range of the file to parse (see shard_annotations()),
+	both must lie on object boundaries
+	"""
+	decoder = json.JSONDecoder()
+	utf8 = codecs.getincrementaldecoder("utf-8")()
+	buf = ""
+	pos = 0
+	eof = False
+	num_objects = 0
+	with open(json_file, "rb") as f:
+		f.seek(start)
+		remaining = None if end is None else end - start
+		while True:
+			#skip whitespace, commas and the opening [ between objects
+			while pos < len(buf) and buf[pos] in _OBJECT_SEPARATORS:
+				pos += 1
+
+			if pos < len(buf) and buf[pos] == "]":
+				return
+
+			obj = None
+			if pos < len(buf):
+				try:
+					obj, obj_end = decoder.raw_decode(buf, pos)
+				except json.JSONDecodeError as e:
+					#an error at the end of the buffer means the object continues past it (or is truncated),
+					#anywhere before that the object itself is malformed
+					if not e.msg.startswith("Unterminated string") and len(buf) - e.pos >= _TRUNCATION_MARGIN:
+						raise ValueError("Malformed json object after " + str(num_objects) + " objects in " + str(json_file) + ": " + str(e)) from e
+					obj = None
+
+			if obj is None:
+				if eof:
+					return
+				data = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+				if remaining is not None:
+					remaining -= len(data)
+				eof = data == b""
+				buf = buf[pos:] + utf8.decode(data, final=eof)
+				pos = 0
+				continue
+
+			pos = obj_end
+			num_objects += 1
+			if isinstance(obj, dict):
+				yield obj
+
+
+
+def iter_opendatacamyolo(yolo_anns, chunk_size=1 << 20):
+	"""
+	Incrementally parse an opendatacamyolo json file, yielding one frame dict
+	of the form {"frame_id": x, "objects": [...]} at a time
+
+	Only a window of roughly chunk_size bytes is held in memory, so this works
+	on multi-GB captures. The raw files written by our intercepted opendatacam
+	are not always valid json, so this tolerates
+	- a missing [ at the beginning of the file
+	- a trailing comma and/or a missing ] at the end of the file
+	- a truncated last frame (e.g. the file is still being written or was cut off),
+	which is silently dropped
+
+	yolo_anns: path to opendatacamyolo json file
+	chunk_size: number of bytes to read from the file at a time
+	"""
+	return _iter_json_objects(yolo_anns, chunk_size)
+
+
+
+
+def iter_faster(faster_anns, chunk_size=1 << 20, start=0, end=None):
+	"""
+	Incrementally parse a faster json (or json lines, see iter_faster_jsonl()) file, yielding one detection dict
+	of the form {"image_id": 0, "category_id": 1, "bbox": [...], "score": 0.99} at a time
+
+	start, end: optional byte range of the file to parse (see shard_annotations())
+	"""
+	if is_jsonl(faster_anns):
+		return _iter_jsonl_detections(faster_anns, start, end)
+	return _iter_json_objects(faster_anns, chunk_size, start, end)
+
+
+
+def is_jsonl(path):
+	"""whether path is a (possibly gzipped) json lines file, judging by its extension"""
+	return str(path).endswith((".jsonl", ".jsonl.gz"))
+
+
+
+def iter_faster_jsonl(faster_anns, start=0, end=None):
+	"""
+	Incrementally parse a faster json lines file (gzipped if it ends with .gz),
+	yielding one frame dict of the form {"image_id": 0, "detections": [{"category_id": 1, "bbox": [...], "score": 0.99}, ...]}
+	per line, i.e. per frame
+
+	These files are written (and flushed) a frame at a time while detection runs, so a truncated
+	last line (the file is still being written or the run was killed) is silently dropped
+
+	start, end: optional byte range of the file to parse, both must lie on line boundaries
+	(not supported for gzipped files)
+	"""
+	if str(faster_anns).endswith(".gz"):
+		lines = _iter_gzip_lines(faster_anns)
+	else:
+		lines = _iter_lines(faster_anns, start, end)
+	for line in lines:
+		if line.strip() == "":
+			continue
+		try:
+			yield json.loads(line)
+		except json.JSONDecodeError:
+			#truncated last frame
+			return
+
+
+
+def _iter_gzip_lines(path):
+	#a gzip stream cut off mid-write raises EOFError once the intact part has been read
+	with gzip.open(path, "rt", encoding="utf-8") as f:
+		try:
+			for line in f:
+				yield line
+		except EOFError:
+			return
+
+
+
+def _iter_jsonl_detections(faster_anns, start=0, end=None):
+	for frame in iter_faster_jsonl(faster_anns, start, end):
+		for det in frame["detections"]:
+			yield dict(det, image_id=frame["image_id"])
+
+
+
+class FasterWriter:
+	"""
+	Streaming writer of faster annotations, a frame at a time
+
+	Every frame is flushed as soon as it is written, so memory use does not grow with
+	the length of the video and an interrupted run keeps all completed frames.
+	The output format follows the extension of output_name
+	- .jsonl: one json object {"image_id": x, "detections": [...]} per frame and line (see iter_faster_jsonl())
+	- .jsonl.gz: the same, gzipped (each frame is a sync flush of the gzip stream, so the file stays readable)
+	- anything else: a regular faster json list of detections
+
+	resume_at: continue an existing output instead of overwriting it, from the position
+	(see FasterWriter.position) it had after its last completely written frame.
+	Anything written after that (e.g. a partial frame of a killed run) is discarded first
+	"""
+
+	def __init__(self, output_name, resume_at=None):
+		self.output_name = output_name
+		self.jsonl = is_jsonl(output_name)
+		self.gzip = str(output_name).endswith(".gz")
+		if resume_at is not None:
+			_truncate_output(output_name, resume_at, self.gzip)
+		mode = "wt" if resume_at is None else "at"
+		if self.gzip:
+			#appending starts a new gzip member, which gzip readers simply concatenate
+			self.file = gzip.open(output_name, mode, encoding="utf-8")
+		else:
+			self.file = open(output_name, mode, encoding="utf-8")
+		#number of (uncompressed) characters in the output, json.dumps only writes ascii
+		self.position = 0 if resume_at is None else resume_at
+		self.empty = self.position <= 1
+		if not self.jsonl and resume_at is None:
+			self._write("[")
+
+	def _write(self, text):
+		self.file.write(text)
+		self.position += len(text)
+
+	def write_frame(self, image_id, category_ids, boxes, scores, propagated=False):
+		"""
+		write the detections of frame image_id
+		category_ids: N torchvision category ids (i.e. class id + 1)
+		boxes: N abs_xmin abs_ymin abs_xmax abs_ymax boxes
+		scores: N confidences
+		propagated: whether the detections were propagated from other frames rather than detected
+		in this one, which marks every detection with "propagated": true
+		"""
+		image_id = int(image_id)
+		detections = [{"category_id": int(category_id), "bbox": list(box), "score": float(score)}
+			for (category_id, box, score) in zip(category_ids, boxes, scores)]
+		if propagated:
+			for det in detections:
+				det["propagated"] = True
+		if self.jsonl:
+			self._write(json.dumps({"image_id": image_id, "detections": detections}) + "\n")
+		else:
+			for det in detections:
+				if not self.empty:
+					self._write(", ")
+				self._write(json.dumps(dict(image_id=image_id, **det)))
+				self.empty = False
+		self.file.flush()
+
+	def close(self):
+		if not self.jsonl:
+			self.file.write("]")
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+
+
+def _truncate_output(output_name, size, gzipped):
+	"""cut output_name down to its first size (uncompressed) characters"""
+	if not gzipped:
+		with open(output_name, "r+b") as f:
+			f.truncate(size)
+		return
+	#a gzip stream cannot be cut at an uncompressed position, so recompress the part to keep
+	tmp_name = str(output_name) + ".tmp"
+	with gzip.open(output_name, "rb") as src, gzip.open(tmp_name, "wb") as dst:
+		remaining = size
+		while remaining > 0:
+			data = src.read(min(remaining, 1 << 20))
+			if not data:
+				break
+			dst.write(data)
+			remaining -= len(data)
+	os.replace(tmp_name, output_name)
+
+
+
+
+class AnnotationStore:
+	"""
+	Columnar, frame-indexed in-memory store for the detections of one video
+
+	All detections are kept sorted by frame in parallel numpy arrays
+	- frame_ids: (N,) int32 frame number (zero-indexed) of each detection
+	- class_ids: (N,) int32 class id of each detection, indexing classes.txt
+	(i.e. coco_names.COCO_INSTANCE_CATEGORY_NAMES without __background__)
+	- confidences: (N,) float64 confidence of each detection (1.0 for ground truth formats)
+	- boxes: (N, 4) float64 absolute abs_xmin abs_ymin abs_xmax abs_ymax of each detection
+	(both float32 when memory-mapped from a binary file, the only place they are stored as float32)
+	- offsets: (max_frame + 2,) int64, the detections of frame f are rows offsets[f]:offsets[f + 1]
+
+	resolution: (W, H) of the video the annotations belong to, used to
+	convert from and to the relative coordinate formats
+	listed_frames: optional sorted frame numbers the input listed, including frames without detections
+	(e.g. an opendatacamyolo frame with no objects, or an empty frame<N>.txt file). By default the
+	frames with detections, see frames_listed()
+	class_names: optional {class_id: name} of the classes, as the input named them (None if it does not),
+	opendatacamyolo class ids are YOLO ones while faster and openimages ones follow COCO_CLASS_NAMES
+	"""
+
+	def __init__(self, frame_ids, class_ids, confidences, boxes, resolution=None, offsets=None, listed_frames=None, class_names=None):
+		self.class_names = class_names
+		self.listed_frames = None if listed_frames is None else np.unique(np.asarray(listed_frames, dtype=np.int64))
+		if offsets is not None:
+			#already sorted by frame and indexed (e.g. memory-mapped from a binary file), use as is
+			self.frame_ids = frame_ids
+			self.class_ids = class_ids
+			self.confidences = confidences
+			self.boxes = boxes
+			self.resolution = resolution
+			self.offsets = offsets
+			return
+
+		frame_ids = np.asarray(frame_ids, dtype=np.int32).reshape(-1)
+		self.class_ids = np.asarray(class_ids, dtype=np.int32).reshape(-1)
+		self.confidences = np.asarray(confidences, dtype=np.float64).reshape(-1)
+		self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		self.frame_ids = frame_ids
+		#inputs are usually written in frame order already, which needs no reordered copy
+		if np.any(frame_ids[1:] < frame_ids[:-1]):
+			order = np.argsort(frame_ids, kind="stable")
+			self.frame_ids = frame_ids[order]
+			self.class_ids = self.class_ids[order]
+			self.confidences = self.confidences[order]
+			self.boxes = self.boxes[order]
+		self.resolution = resolution
+
+		#offsets[f] is the index of the first detection of frame f
+		max_frame = int(self.frame_ids[-1]) if len(self.frame_ids) else -1
+		if self.listed_frames is not None and len(self.listed_frames):
+			max_frame = max(max_frame, int(self.listed_frames[-1]))
+		counts = np.bincount(self.frame_ids, minlength=max_frame + 1) if len(self.frame_ids) else np.zeros(0, dtype=np.int64)
+		self.offsets = np.zeros(max_frame + 2, dtype=np.int64)
+		np.cumsum(counts, out=self.offsets[1:])
+
+
+	def __len__(self):
+		return len(self.frame_ids)
+
+
+	@property
+	def num_frames(self):
+		"""number of frames covered by the store, i.e. last annotated (or listed) frame + 1"""
+		return len(self.offsets) - 1
+
+
+	def get_frame(self, frame_num):
+		"""
+		Returns (class_ids, confidences, boxes) for the detections in frame frame_num
+		as views into the store's arrays (empty arrays if the frame has no detections)
+		"""
+		if frame_num < 0 or frame_num >= self.num_frames:
+			start = end = 0
+		else:
+			start = self.offsets[frame_num]
+			end = self.offsets[frame_num + 1]
+		return (self.class_ids[start:end], self.confidences[start:end], self.boxes[start:end])
+
+
+	def frames_with_detections(self):
+		"""Returns the sorted frame numbers that have at least one detection"""
+		return np.flatnonzero(np.diff(self.offsets))
+
+
+	def frames_listed(self):
+		"""Returns the sorted frame numbers the input listed (with or without detections)"""
+		if self.listed_frames is None:
+			return self.frames_with_detections()
+		return self.listed_frames
+
+
+	def slice_frames(self, first_frame, last_frame):
+		"""Returns a new store with only the detections of frames first_frame up to (excluding) last_frame"""
+		start = self.offsets[min(max(first_frame, 0), self.num_frames)]
+		end = self.offsets[min(max(last_frame, 0), self.num_frames)]
+		listed = self.frames_listed()
+		listed = listed[(listed >= first_frame) & (listed < last_frame)]
+		return AnnotationStore(self.frame_ids[start:end], self.class_ids[start:end], self.confidences[start:end],
+			self.boxes[start:end], self.resolution, listed_frames=listed, class_names=self.class_names)
+
+
+	def split_frames(self, num_parts):
+		"""
+		Split the store into at most num_parts stores covering consecutive frame ranges,
+		each holding roughly the same number of listed frames (see frames_listed())
+		"""
+		frames = self.frames_listed()
+		if len(frames) == 0:
+			#nothing to split, a single (empty) part keeps the output identical to the serial path
+			return [self]
+		chunks = np.array_split(frames, min(num_parts, len(frames)))
+		starts = [0] + [int(chunk[0]) for chunk in chunks[1:]]
+		ends = starts[1:] + [self.num_frames]
+		return [self.slice_frames(start, end) for (start, end) in zip(starts, ends)]
+
+
+	def filter_classes(self, class_filter):
+		"""
+		Returns a new store with only the detections whose class_id is in class_filter
+		(an empty class_filter keeps everything)
+		"""
+		if len(class_filter) == 0:
+			return self
+		keep = np.isin(self.class_ids, class_filter)
+		return AnnotationStore(self.frame_ids[keep], self.class_ids[keep], self.confidences[keep], self.boxes[keep], self.resolution,
+			listed_frames=self.frames_listed(), class_names=self.class_names)
+
+
+
+
+def merge_stores(stores, resolution=None):
+	"""
+	Merge stores parsed from consecutive shards of the same annotations (see shard_annotations())
+	into a single store, identical to the one parsing the whole input at once would have built
+	"""
+	class_names = None
+	for store in stores:
+		if store.class_names is not None:
+			class_names = {**(class_names or {}), **store.class_names}
+	return AnnotationStore(np.concatenate([store.frame_ids for store in stores]),
+		np.concatenate([store.class_ids for store in stores]),
+		np.concatenate([store.confidences for store in stores]),
+		np.concatenate([store.boxes for store in stores]), resolution,
+		listed_frames=np.concatenate([store.frames_listed() for store in stores]), class_names=class_names)
+
+
+
+
+def relxywh_to_absxyxy(xywh, resolution):
+	"""
+	Convert an (N, 4) array of rel_centerx rel_centery rel_width rel_height boxes
+	to an (N, 4) array of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	"""
+	(W, H) = resolution
+	#computed in a single output array (same operations, so the same values, as xy -+ wh / 2)
+	xyxy = np.asarray(xywh, dtype=np.float64).reshape(-1, 4) * np.array([W, H, W, H])
+	half = xyxy[:, 2:] / 2
+	np.add(xyxy[:, :2], half, out=xyxy[:, 2:])
+	xyxy[:, :2] -= half
+	return xyxy
+
+
+
+def absxywh_to_absxyxy(xywh):
+	"""
+	Convert an (N, 4) array of abs_xmin abs_ymin abs_width abs_height boxes
+	to an (N, 4) array of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	"""
+	xywh = np.asarray(xywh, dtype=np.float64).reshape(-1, 4)
+	return np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+
+
+
+
+def absxyxy_to_relxywh(xyxy, resolution):
+	"""
+	Convert an (N, 4) array of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	to an (N, 4) array of rel_centerx rel_centery rel_width rel_height boxes
+	"""
+	(W, H) = resolution
+	xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+	size = xyxy[:, 2:] - xyxy[:, :2]
+	return np.concatenate([xyxy[:, :2] + size / 2, size], axis=1) / np.array([W, H, W, H])
+
+
+
+def absxyxy_to_absxywh(xyxy):
+	"""
+	Convert an (N, 4) array of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	to an (N, 4) array of abs_xmin abs_ymin abs_width abs_height boxes
+	"""
+	xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+	return np.concatenate([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+
+
+
+def box_iou(boxes_a, boxes_b):
+	"""
+	Returns the (N, M) matrix of intersection over union of every box of the
+	(N, 4) and (M, 4) arrays of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	"""
+	boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+	boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+	#width and height of the overlaps as separate (N, M) arrays, updated in place
+	widths = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+	widths -= np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+	heights = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+	heights -= np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+	intersection = np.maximum(widths, 0, out=widths)
+	intersection *= np.maximum(heights, 0, out=heights)
+	area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+	area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+	union = area_a[:, None] + area_b[None, :] - intersection
+	return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+
+
+class _DetectionColumns:
+	"""
+	Column buffer the loaders parse detections into: values are collected in short Python lists
+	that are flushed to numpy arrays every chunk_size detections (or listed frames), so a
+	multi-GB input is never held as Python objects, only as its final arrays
+	"""
+
+	def __init__(self, chunk_size=1 << 14):
+		self.chunk_size = chunk_size
+		self.frame_ids = []
+		self.class_ids = []
+		self.confidences = []
+		self.boxes = []
+		self.listed_frames = []
+		self.chunks = []
+		self.listed_chunks = []
+
+	def append(self, frame_id, class_id, confidence, box):
+		self.frame_ids.append(frame_id)
+		self.class_ids.append(class_id)
+		self.confidences.append(confidence)
+		self.boxes.append(box)
+		if len(self.frame_ids) >= self.chunk_size:
+			self._flush()
+
+	def list_frame(self, frame_id):
+		"""record that the input listed frame_id (with or without detections)"""
+		self.listed_frames.append(frame_id)
+		if len(self.listed_frames) >= self.chunk_size:
+			self.listed_chunks.append(np.array(self.listed_frames, dtype=np.int64))
+			self.listed_frames = []
+
+	def _flush(self):
+		if len(self.frame_ids) == 0:
+			return
+		self.chunks.append((np.array(self.frame_ids, dtype=np.int32), np.array(self.class_ids, dtype=np.int32),
+			np.array(self.confidences, dtype=np.float64), np.array(self.boxes, dtype=np.float64).reshape(-1, 4)))
+		self.frame_ids = []
+		self.class_ids = []
+		self.confidences = []
+		self.boxes = []
+
+	def arrays(self):
+		"""Returns (frame_ids, class_ids, confidences, boxes, listed_frames) of everything appended"""
+		self._flush()
+		if len(self.chunks) == 0:
+			columns = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros((0, 4)))
+		else:
+			#one column at a time, dropping its chunks once concatenated
+			chunks = [list(column) for column in zip(*self.chunks)]
+			self.chunks = []
+			columns = []
+			while chunks:
+				columns.append(np.concatenate(chunks.pop(0)))
+			columns = tuple(columns)
+		listed_frames = np.concatenate(self.listed_chunks + [np.array(self.listed_frames, dtype=np.int64)])
+		return columns + (listed_frames,)
+
+
+
+def _load_opendatacamyolo(input_annotations, resolution, shard=None):
+	(start, end) = shard if shard is not None else (0, None)
+	columns = _DetectionColumns()
+	#the names the file gives its (YOLO) class ids
+	class_names = {}
+	for frame_data in _iter_json_objects(input_annotations, start=start, end=end):
+		frame_id = frame_data["frame_id"]
+		columns.list_frame(frame_id)
+		for det in frame_data["objects"]:
+			box_raw = det["relative_coordinates"]
+			columns.append(frame_id, det["class_id"], det["confidence"],
+				(box_raw["center_x"], box_raw["center_y"], box_raw["width"], box_raw["height"]))
+			if det["class_id"] not in class_names and "name" in det:
+				class_names[det["class_id"]] = det["name"]
+	(frame_ids, class_ids, confidences, boxes, listed_frames) = columns.arrays()
+	return AnnotationStore(frame_ids, class_ids, confidences, relxywh_to_absxyxy(boxes, resolution), resolution,
+		listed_frames=listed_frames, class_names=class_names or None)
+
+
+
+def _load_faster(input_annotations, resolution, shard=None):
+	(start, end) = shard if shard is not None else (0, None)
+	columns = _DetectionColumns()
+	for ann in iter_faster(input_annotations, start=start, end=end):
+		columns.append(ann["image_id"], ann["category_id"] - 1, #adjust down because of extraneous inclusion of background
+			ann["score"] if "score" in ann else ann["confidence_score"], ann["bbox"])
+	(frame_ids, class_ids, confidences, boxes, listed_frames) = columns.arrays()
+	return AnnotationStore(frame_ids, class_ids, confidences, boxes, resolution, class_names=COCO_CLASS_NAMES)
+
+
+
+def _iter_lines(path, start=0, end=None):
+	"""yield the decoded lines of path that start within the byte range start, end"""
+	with open(path, "rb") as f:
+		f.seek(start)
+		pos = start
+		for line in f:
+			if end is not None and pos >= end:
+				return
+			pos += len(line)
+			yield line.decode("utf-8")
+
+
+
+def _load_openimages(input_annotations, resolution, shard=None):
+	(start, end) = shard if shard is not None else (0, None)
+	columns = _DetectionColumns()
+	lines = _iter_lines(input_annotations, start, end)
+	if start == 0:
+		headers = next(lines, None)
+	for line in lines:
+		data = line.split(",")
+		if len(data) < 8:
+			continue
+		columns.append(int(data[0].split("frame")[1].split(".jpg")[0]),
+			coco_names.COCO_INSTANCE_CATEGORY_NAMES.index(data[2]) - 1, #adjust down because of extraneous inclusion of background
+			float(data[3]) if data[3].strip() != "" else 1.0,
+			#XMin, XMax, YMin, YMax
+			(float(data[4]), float(data[6]), float(data[5]), float(data[7])))
+	(frame_ids, class_ids, confidences, boxes, listed_frames) = columns.arrays()
+	return AnnotationStore(frame_ids, class_ids, confidences, boxes, resolution, class_names=COCO_CLASS_NAMES)
+
+
+
+#matches the per-frame file names of the folder formats, e.g. frame12.txt
+FRAME_FILE_PATTERN = re.compile(r"^frame(\d+)\.txt$")
+
+
+
+def scan_frame_files(input_annotations):
+	"""
+	Scan a folder of per-frame annotation files once and
+	return a dict mapping frame number -> path of that frame's file
+	"""
+	frame_files = {}
+	with os.scandir(input_annotations) as entries:
+		for entry in entries:
+			match = FRAME_FILE_PATTERN.match(entry.name)
+			if match is not None:
+				frame_files[int(match.group(1))] = entry.path
+	return frame_files
+
+
+
+def read_frame_file(path, annotation_format):
+	"""
+	Parse one per-frame file of a folder format (yolo, relxywh, absxywh or absolute)
+	Returns (class_ids, confidences, boxes), with the four box coordinates
+	exactly as written in the file
+	"""
+	class_ids = []
+	confidences = []
+	boxes = []
+	with open(path, "r") as dets:
+		for line in dets:
+			data = line.split()
+			if len(data) == 0:
+				continue
+			class_ids.append(int(data[0]))
+			if annotation_format in ("yolo", "absolute"):
+				confidences.append(1.0) #because these are gt formats
+				boxes.append([float(v) for v in data[1:5]])
+			else:
+				confidences.append(float(data[1]))
+				boxes.append([float(v) for v in data[2:6]])
+	return (class_ids, confidences, boxes)
+
+
+
+def _load_frame_folder(input_annotations, resolution, annotation_format, shard=None):
+	frame_files = shard if shard is not None else sorted(scan_frame_files(input_annotations).items())
+	columns = _DetectionColumns()
+	for (frame_id, path) in frame_files:
+		columns.list_frame(frame_id)
+		for detection in zip(*read_frame_file(path, annotation_format)):
+			columns.append(frame_id, *detection)
+
+	(frame_ids, class_ids, confidences, boxes, listed_frames) = columns.arrays()
+	boxes = _folder_boxes_to_absxyxy(boxes, annotation_format, resolution)
+	return AnnotationStore(frame_ids, class_ids, confidences, boxes, resolution, listed_frames=listed_frames)
+
+
+
+def _folder_boxes_to_absxyxy(boxes, annotation_format, resolution):
+	"""convert boxes as written in the files of a folder format to absolute xyxy"""
+	if annotation_format in ("yolo", "relxywh"):
+		return relxywh_to_absxyxy(boxes, resolution)
+	elif annotation_format == "absxywh":
+		return absxywh_to_absxyxy(boxes)
+	return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+
+class FrameFolderAnnotations:
+	"""
+	Lazy, frame-indexed reader for the folder formats (yolo, relxywh, absxywh, absolute)
+
+	The folder is listed once, building a frame number -> path map. A frame's file is only
+	parsed the first time that frame is requested, and the most recently used max_cached_frames
+	parsed frames are kept in memory, so rendering a long video needs neither one directory
+	listing per frame nor the whole folder in memory.
+	get_frame() returns the same (class_ids, confidences, boxes) arrays as AnnotationStore.get_frame()
+	"""
+
+	def __init__(self, input_annotations, annotation_format, resolution, max_cached_frames=256):
+		self.annotation_format = annotation_format
+		self.resolution = resolution
+		self.frame_files = scan_frame_files(input_annotations)
+		self.max_cached_frames = max_cached_frames
+		self._cache = OrderedDict()
+		#get_frame may be called from several drawing threads at once
+		self._lock = threading.Lock()
+
+
+	def __len__(self):
+		return len(self.frame_files)
+
+
+	@property
+	def num_frames(self):
+		"""number of frames covered by the folder, i.e. last annotated frame + 1"""
+		return max(self.frame_files) + 1 if self.frame_files else 0
+
+
+	def get_frame(self, frame_num):
+		with self._lock:
+			if frame_num in self._cache:
+				self._cache.move_to_end(frame_num)
+				return self._cache[frame_num]
+
+		if frame_num in self.frame_files:
+			(class_ids, confidences, boxes) = read_frame_file(self.frame_files[frame_num], self.annotation_format)
+			boxes = _folder_boxes_to_absxyxy(boxes, self.annotation_format, self.resolution)
+		else:
+			(class_ids, confidences, boxes) = ([], [], np.zeros((0, 4)))
+		frame = (np.asarray(class_ids, dtype=np.int32), np.asarray(confidences, dtype=np.float64),
+			np.asarray(boxes, dtype=np.float64).reshape(-1, 4))
+
+		with self._lock:
+			self._cache[frame_num] = frame
+			if len(self._cache) > self.max_cached_frames:
+				self._cache.popitem(last=False)
+		return frame
+
+
+
+def open_annotations(input_annotations, annotation_format, resolution):
+	"""
+	Open annotations of any supported format for frame by frame access through get_frame():
+	folder formats are read lazily with a FrameFolderAnnotations, everything else is
+	parsed once into an AnnotationStore with load_annotations()
+	"""
+	if annotation_format in ("yolo", "relxywh", "absxywh", "absolute"):
+		return FrameFolderAnnotations(input_annotations, annotation_format, resolution)
+	return load_annotations(input_annotations, annotation_format, resolution)
+
+
+
+
+"""
+binary: compact on-disk format for an AnnotationStore, meant to be memory-mapped
+	header: magic b"ODCDETS1", uint32 W, uint32 H, uint64 number of records N, uint64 number of offsets M
+	N fixed-width little-endian records (see DETECTION_RECORD), sorted by frame
+	padding up to a multiple of 8 bytes
+	M int64 frame offsets, the records of frame f are records[offsets[f]:offsets[f + 1]]
+	W and H are 0 if the resolution is unknown
+"""
+BINARY_MAGIC = b"ODCDETS1"
+BINARY_HEADER = np.dtype([("magic", "S8"), ("width", "<u4"), ("height", "<u4"), ("num_records", "<u8"), ("num_offsets", "<u8")])
+DETECTION_RECORD = np.dtype([("frame", "<i4"), ("class_id", "<i4"), ("confidence", "<f4"), ("box", "<f4", (4,))])
+
+
+
+def _binary_offsets_start(num_records):
+	records_end = BINARY_HEADER.itemsize + num_records * DETECTION_RECORD.itemsize
+	return (records_end + 7) // 8 * 8
+
+
+
+def save_binary(store, output_name):
+	"""
+	Write an AnnotationStore to output_name in the binary format
+	(confidences and boxes are stored as float32)
+	"""
+	(W, H) = store.resolution if store.resolution is not None else (0, 0)
+	header = np.zeros(1, dtype=BINARY_HEADER)
+	header["magic"] = BINARY_MAGIC
+	header["width"] = W
+	header["height"] = H
+	header["num_records"] = len(store)
+	header["num_offsets"] = len(store.offsets)
+
+	records = np.empty(len(store), dtype=DETECTION_RECORD)
+	records["frame"] = store.frame_ids
+	records["class_id"] = store.class_ids
+	records["confidence"] = store.confidences
+	records["box"] = store.boxes
+
+	with open(output_name, "wb") as output:
+		output.write(header.tobytes())
+		output.write(records.tobytes())
+		output.write(b"\0" * (_binary_offsets_start(len(store)) - output.tell()))
+		output.write(np.asarray(store.offsets, dtype="<i8").tobytes())
+
+
+
+def load_binary(input_annotations):
+	"""
+	Memory-map a binary annotation file as an AnnotationStore
+
+	Nothing is parsed or copied, so this returns instantly regardless of file size
+	and concurrent processes reading the same file share its pages.
+	Frame lookups are a constant-time slice of the mapped records
+	"""
+	header = np.fromfile(input_annotations, dtype=BINARY_HEADER, count=1)
+	if len(header) != 1 or header["magic"][0] != BINARY_MAGIC:
+		raise ValueError(str(input_annotations) + " is not a binary annotation file")
+	num_records = int(header["num_records"][0])
+	num_offsets = int(header["num_offsets"][0])
+	(W, H) = (int(header["width"][0]), int(header["height"][0]))
+
+	if num_records > 0:
+		records = np.memmap(input_annotations, dtype=DETECTION_RECORD, mode="r",
+			offset=BINARY_HEADER.itemsize, shape=(num_records,))
+	else:
+		records = np.zeros(0, dtype=DETECTION_RECORD)
+	offsets = np.memmap(input_annotations, dtype="<i8", mode="r",
+		offset=_binary_offsets_start(num_records), shape=(num_offsets,))
+
+	resolution = (W, H) if W > 0 and H > 0 else None
+	return AnnotationStore(records["frame"], records["class_id"], records["confidence"], records["box"], resolution, offsets)
+
+
+
+ANNOTATION_FORMATS = ["opendatacamyolo", "openimages", "yolo", "absxywh", "relxywh", "absolute", "faster", "binary"]
+
+#formats whose boxes are relative to the video resolution, so loading them requires it
+RELATIVE_FORMATS = ["opendatacamyolo", "yolo", "relxywh"]
+
+
+
+def load_annotations(input_annotations, annotation_format, resolution, shard=None):
+	"""
+	Parse annotations of any supported format (see format specifications at the top of visual_utils.py)
+	once into an AnnotationStore
+
+	input_annotations: depending on the annotation_format parameter, this should be
+	either a folder containing a text file of annotations for each frame, or a json/csv file
+	annotation_format: format of input_annotations
+	resolution: resolution of the video in pixels, represented by the tuple (W, H)
+	shard: optional, one of the shards returned by shard_annotations() to parse only that part of the input
+	"""
+	if annotation_format in ("opendatacamyolo", "opendatacam_yolo"):
+		return _load_opendatacamyolo(input_annotations, resolution, shard)
+	elif annotation_format == "faster":
+		return _load_faster(input_annotations, resolution, shard)
+	elif annotation_format == "binary":
+		return load_binary(input_annotations)
+	elif annotation_format == "openimages":
+		return _load_openimages(input_annotations, resolution, shard)
+	elif annotation_format in ("yolo", "relxywh", "absxywh", "absolute"):
+		return _load_frame_folder(input_annotations, resolution, annotation_format, shard)
+	else:
+		raise ValueError("Unsupported annotation format " + str(annotation_format))
+
+
+
+#start of a top level object in the json formats, used to split them at object boundaries
+_OBJECT_START_PATTERNS = {
+	"opendatacamyolo": re.compile(rb'\{\s*"frame_id"'),
+	"opendatacam_yolo": re.compile(rb'\{\s*"frame_id"'),
+	"faster": re.compile(rb'\{\s*"image_id"'),
+	"openimages": re.compile(rb"\n"),
+}
+
+
+
+def _find_boundary(path, pos, pattern, chunk_size=1 << 20):
+	"""
+	Returns the byte offset of the first object (or line, for openimages) starting
+	at or after byte pos of path, or the size of the file if there is none
+	"""
+	overlap = 64
+	with open(path, "rb") as f:
+		f.seek(pos)
+		while True:
+			data = f.read(chunk_size)
+			match = pattern.search(data)
+			if match is not None:
+				#openimages lines start right after the newline
+				return pos + (match.end() if match.group() == b"\n" else match.start())
+			if len(data) < chunk_size:
+				return os.path.getsize(path)
+			pos += len(data) - overlap
+			f.seek(pos)
+
+
+
+def shard_annotations(input_annotations, annotation_format, num_shards):
+	"""
+	Split annotations into at most num_shards shards that can be parsed independently
+	(e.g. in a process pool) with load_annotations(..., shard=shard)
+	and then combined with merge_stores() in order
+
+	The json and csv formats are split into byte ranges at object/line boundaries (lines for faster json lines files),
+	the folder formats into lists of consecutive frame files.
+	Formats that cannot be split (binary, which needs no parsing, and gzipped json lines) return a single shard of None
+	"""
+	if annotation_format == "faster" and is_jsonl(input_annotations):
+		if str(input_annotations).endswith(".gz"):
+			return [None]
+		pattern = _OBJECT_START_PATTERNS["openimages"]
+	elif annotation_format in _OBJECT_START_PATTERNS:
+		pattern = _OBJECT_START_PATTERNS[annotation_format]
+	if annotation_format in _OBJECT_START_PATTERNS:
+		size = os.path.getsize(input_annotations)
+		boundaries = [0]
+		for i in range(1, num_shards):
+			boundary = _find_boundary(input_annotations, size * i // num_shards, pattern)
+			if boundary > boundaries[-1]:
+				boundaries.append(boundary)
+		if boundaries[-1] < size or len(boundaries) == 1:
+			boundaries.append(size)
+		return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+	elif annotation_format in ("yolo", "relxywh", "absxywh", "absolute"):
+		frame_files = sorted(scan_frame_files(input_annotations).items())
+		num_shards = max(1, min(num_shards, len(frame_files)))
+		return [frame_files[len(frame_files) * i // num_shards:len(frame_files) * (i + 1) // num_shards] for i in range(num_shards)]
+	else:
+		return [None]
@@ -0,0 +1,337 @@
+"""
+benchmark.py
+
+Reproducible benchmarks of the annotation conversion, rendering and detection code, so the speed
+of a change can be measured before and after it on exactly the same input
+
+Generates a synthetic video (moving boxes on a noisy background, of configurable resolution,
+length and number of objects) with matching synthetic annotations in every format of the spec
+at the top of visual_utils.py, then times
+- convert: convert_annotations.convert() from opendatacamyolo to every format, and from every format to binary
+- render: visual_utils.create_annotated_video() from every format (with its per-stage timings)
+- draw: visual_utils.draw_annotated_frame() on a list of frames spread over the video, from every format
+- detect: faster_rcnn/detect_vid.py on the first frames of the video, with a tiny randomly initialized
+model (--random-model), so it runs offline on the CPU (with its per-stage timings)
+
+Every benchmark runs --repeat times, the median is reported. The JSON report holds the environment
+(versions, CPU count, git commit), the configuration and one entry per benchmark keyed by its name,
+so reports of different commits or machines can be compared with --baseline
+	{"environment": {...}, "config": {...}, "results": {"render faster": {"group": "render", "seconds": float,
+	"min_s": float, "runs": int, "frames": int, "fps": float, "stages": {...}}, ...}}
+
+usage: python benchmark.py -o report.json [--width 1280 --height 720 --frames 300 --objects 200] [--baseline old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# coco_names (needed by annotation_utils and convert_annotations) lives in faster_rcnn
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "faster_rcnn"))
+import annotation_utils
+import convert_annotations
+import timing_utils
+import visual_utils
+
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARKS = ["convert", "render", "draw", "detect"]
+
+#every annotation format of the visual_utils.py spec, as (name, annotation format, path in the annotations folder)
+FORMATS = [
+	("opendatacamyolo", "opendatacamyolo", "opendatacamyolo.json"),
+	("openimages", "openimages", "openimages.csv"),
+	("yolo", "yolo", "yolo"),
+	("absxywh", "absxywh", "absxywh"),
+	("relxywh", "relxywh", "relxywh"),
+	("absolute", "absolute", "absolute"),
+	("faster", "faster", "faster.json"),
+	("faster_jsonl", "faster", "faster.jsonl"),
+	("faster_jsonl_gz", "faster", "faster.jsonl.gz"),
+	("binary", "binary", "binary.bin"),
+]
+
+#classes the synthetic objects are drawn from (indices of classes.txt: person, bicycle, car, motorcycle, bus, truck)
+SYNTHETIC_CLASSES = [0, 1, 2, 3, 5, 7]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-o", "--output", default="benchmark-report.json", help='path to write the json report to')
+parser.add_argument("--width", type=int, default=640, help='width of the synthetic video')
+parser.add_argument("--height", type=int, default=360, help='height of the synthetic video')
+parser.add_argument("--frames", type=int, default=150, help='number of frames of the synthetic video')
+parser.add_argument("--objects", type=int, default=50, help='number of objects (annotations) in every frame')
+parser.add_argument("--fps", type=float, default=30, help='frame rate of the synthetic video')
+parser.add_argument("--seed", type=int, default=0, help='seed of the synthetic video and annotations')
+parser.add_argument("--repeat", type=int, default=3, help='number of runs of every benchmark, the median is reported')
+parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run (default: all)')
+parser.add_argument("--formats", nargs="+", choices=[name for (name, _, _) in FORMATS], help='annotation formats to benchmark (default: all)')
+parser.add_argument("-w", "--workers", type=int, default=4, help='number of drawing threads of create_annotated_video')
+parser.add_argument("--draw_frames", type=int, default=10, help='number of frames draw_annotated_frame renders')
+parser.add_argument("--detect_frames", type=int, default=20, help='number of frames detect_vid.py runs on')
+parser.add_argument("--min_size", type=int, default=320, help='minimum input size of the detection model')
+parser.add_argument("--work_dir", help='folder for the synthetic data and outputs (default: a temporary folder, removed afterwards)')
+parser.add_argument("--baseline", help='path of an earlier report to compare against')
+
+
+
+def synthetic_store(num_frames, num_objects, resolution, seed=0):
+	"""
+	AnnotationStore of num_objects boxes in each of num_frames frames, every object moving
+	at its own constant speed and bouncing off the borders of a resolution (W, H) video
+	"""
+	rng = np.random.RandomState(seed)
+	frame_size = np.array(resolution, dtype=np.float64)
+	sizes = rng.uniform(0.03, 0.15, (num_objects, 2)) * frame_size
+	#room each object has to move in, along x and y
+	travel = frame_size - sizes
+	starts = rng.uniform(0, 1, (num_objects, 2)) * travel
+	velocities = rng.uniform(-0.01, 0.01, (num_objects, 2)) * frame_size
+	#(frames, objects, 2) top left corners, folded back into [0, travel] (a triangle wave)
+	positions = starts + velocities * np.arange(num_frames)[:, None, None]
+	positions = travel - np.abs(np.mod(positions, 2 * travel) - travel)
+	boxes = np.concatenate([positions, positions + sizes], axis=2).round(2)
+
+	frame_ids = np.repeat(np.arange(num_frames), num_objects)
+	class_ids = np.tile(rng.choice(SYNTHETIC_CLASSES, num_objects), num_frames)
+	confidences = rng.uniform(0.3, 1.0, num_frames * num_objects).round(4)
+	return annotation_utils.AnnotationStore(frame_ids, class_ids, confidences, boxes.reshape(-1, 4), resolution)
+
+
+
+def write_synthetic_video(output_name, store, fps=30, num_frames=None, seed=0):
+	"""
+	write the (first num_frames) frames of store as an mp4 video: its boxes filled in a color per class
+	on a noisy background, so the encoder has texture to compress. Returns the number of frames written
+	"""
+	import cv2
+
+	(width, height) = store.resolution
+	num_frames = store.num_frames if num_frames is None else min(num_frames, store.num_frames)
+	rng = np.random.RandomState(seed)
+	background = rng.randint(40, 120, (height, width, 3)).astype(np.uint8)
+	colors = rng.randint(0, 255, (max(SYNTHETIC_CLASSES) + 1, 3)).tolist()
+	out = cv2.VideoWriter(output_name, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+	for frame_num in range(num_frames):
+		frame = background.copy()
+		(class_ids, _, boxes) = store.get_frame(frame_num)
+		for (class_id, box) in zip(class_ids.tolist(), boxes.astype(np.int32).tolist()):
+			cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), colors[class_id], -1)
+		out.write(frame)
+	out.release()
+	return num_frames
+
+
+
+def measure(function, repeat=3, setup=None):
+	"""run function repeat times (calling setup, untimed, before each run) and return the seconds of every run"""
+	runs = []
+	for _ in range(repeat):
+		if setup is not None:
+			setup()
+		start = time.perf_counter()
+		function()
+		runs.append(time.perf_counter() - start)
+	return runs
+
+
+
+def _result(group, runs, frames=None, **extra):
+	#report entry of a benchmark: median and best of its runs, and the frames per second of the median
+	seconds = float(np.median(runs))
+	result = {"group": group, "seconds": round(seconds, 6), "min_s": round(min(runs), 6), "runs": len(runs)}
+	if frames is not None:
+		result["frames"] = frames
+		result["fps"] = round(frames / seconds, 3) if seconds > 0 else 0.0
+	result.update(extra)
+	return result
+
+
+
+def _fresh_folder(path):
+	#empty (or create) path, so every conversion to a folder format starts from scratch
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+	os.makedirs(path)
+
+
+
+def benchmark_convert(source, annotations_dir, formats, resolution, repeat):
+	"""time opendatacamyolo -> every format (which writes the annotations the other benchmarks read) and every format -> binary"""
+	results = {}
+	for (name, annotation_format, path) in formats:
+		output = os.path.join(annotations_dir, path)
+		setup = (lambda output=output: _fresh_folder(output)) if annotation_format in convert_annotations.FOLDER_FORMATS else None
+		runs = measure(lambda: convert_annotations.convert(source, "opendatacamyolo", output, annotation_format, resolution=resolution), repeat, setup)
+		results["convert opendatacamyolo->" + name] = _result("convert", runs)
+
+	scratch = os.path.join(annotations_dir, "scratch.bin")
+	for (name, annotation_format, path) in formats:
+		runs = measure(lambda: convert_annotations.convert(os.path.join(annotations_dir, path), annotation_format, scratch, "binary", resolution=resolution), repeat)
+		results["convert " + name + "->binary"] = _result("convert", runs)
+	os.remove(scratch)
+	return results
+
+
+
+def write_formats(source, annotations_dir, formats, resolution):
+	"""write the annotations in every format without timing it (when the convert benchmark is skipped)"""
+	for (name, annotation_format, path) in formats:
+		output = os.path.join(annotations_dir, path)
+		if annotation_format in convert_annotations.FOLDER_FORMATS:
+			_fresh_folder(output)
+		convert_annotations.convert(source, "opendatacamyolo", output, annotation_format, resolution=resolution)
+
+
+
+def benchmark_render(video, annotations_dir, output_dir, formats, workers, repeat):
+	"""time create_annotated_video from every format, keeping the stage timings of its last run"""
+	results = {}
+	for (name, annotation_format, path) in formats:
+		timers = []
+		def run():
+			timers.append(timing_utils.StageTimer())
+			(frame_count, _) = visual_utils.create_annotated_video(video, os.path.join(annotations_dir, path), os.path.join(output_dir, name),
+				annotation_format, workers=workers, timer=timers[-1])
+			run.frames = frame_count
+		runs = measure(run, repeat)
+		results["render " + name] = _result("render", runs, run.frames, stages=timers[-1].summary()["stages"])
+	return results
+
+
+
+def benchmark_draw(video, annotations_dir, output_dir, formats, num_frames, draw_frames, repeat):
+	"""time draw_annotated_frame on draw_frames frames spread evenly over the video, from every format"""
+	target_frames = sorted(set(np.linspace(0, num_frames - 1, draw_frames).astype(int).tolist()))
+	results = {}
+	for (name, annotation_format, path) in formats:
+		runs = measure(lambda: visual_utils.draw_annotated_frame(video, os.path.join(annotations_dir, path), target_frames,
+			os.path.join(output_dir, name), annotation_format), repeat)
+		results["draw " + name] = _result("draw", runs, len(target_frames))
+	return results
+
+
+
+def benchmark_detect(video, work_dir, min_size, repeat):
+	"""
+	time faster_rcnn/detect_vid.py on video with a tiny randomly initialized model, as a separate process
+	(so the time includes starting python and importing torch), keeping the stage timings of its last run
+	"""
+	os.makedirs(os.path.join(work_dir, "outputs"), exist_ok=True)
+	timings_name = os.path.join(work_dir, "detect-timings.json")
+	command = [sys.executable, os.path.join(REPO_DIR, "faster_rcnn", "detect_vid.py"), "-i", video, "-m", str(min_size),
+		"--random-model", "--quiet", "--timings", timings_name]
+
+	def run():
+		process = subprocess.run(command, cwd=work_dir, capture_output=True, text=True)
+		if process.returncode != 0:
+			raise RuntimeError("detect_vid.py failed:\n" + process.stderr[-2000:])
+	runs = measure(run, repeat)
+	with open(timings_name) as f:
+		timings = json.load(f)
+	return {"detect random_model": _result("detect", runs, timings["frames"], stages=timings["stages"])}
+
+
+
+def environment():
+	"""versions and machine the benchmarks ran on, to tell whether two reports are comparable"""
+	from importlib import metadata
+
+	versions = {}
+	for package in ("numpy", "opencv-python", "opencv-python-headless", "torch", "torchvision"):
+		try:
+			versions[package] = metadata.version(package)
+		except metadata.PackageNotFoundError:
+			continue
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+	except OSError:
+		commit = None
+	return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+		"cpu_count": os.cpu_count(), "packages": versions, "commit": commit}
+
+
+
+def compare(report, baseline):
+	"""table of the benchmarks in both reports, with the speedup of report over baseline"""
+	lines = ["{:<44}{:>12}{:>12}{:>10}".format("benchmark", "seconds", "baseline", "speedup")]
+	for (name, result) in report["results"].items():
+		if name not in baseline["results"]:
+			continue
+		before = baseline["results"][name]["seconds"]
+		speedup = before / result["seconds"] if result["seconds"] > 0 else float("inf")
+		lines.append("{:<44}{:>12.4f}{:>12.4f}{:>9.2f}x".format(name, result["seconds"], before, speedup))
+	if baseline.get("config") != report["config"]:
+		lines.append("NOTE: the baseline was run with a different configuration")
+	return "\n".join(lines)
+
+
+
+def run(args):
+	"""run the benchmarks described by the parsed command line args, returns the report"""
+	resolution = (args["width"], args["height"])
+	formats = [f for f in FORMATS if args["formats"] is None or f[0] in args["formats"]]
+	work_dir = args["work_dir"] or tempfile.mkdtemp(prefix="benchmark-")
+	annotations_dir = os.path.join(work_dir, "annotations")
+	output_dir = os.path.join(work_dir, "rendered")
+	os.makedirs(annotations_dir, exist_ok=True)
+	os.makedirs(output_dir, exist_ok=True)
+
+	try:
+		#synthetic input, not timed
+		store = synthetic_store(args["frames"], args["objects"], resolution, args["seed"])
+		video = os.path.join(work_dir, "synthetic.mp4")
+		write_synthetic_video(video, store, args["fps"], seed=args["seed"])
+		source = os.path.join(work_dir, "source-opendatacamyolo.json")
+		convert_annotations.write_opendatacamyolo(store, source)
+
+		results = {}
+		if "convert" in args["benchmarks"]:
+			results.update(benchmark_convert(source, annotations_dir, formats, resolution, args["repeat"]))
+		elif "render" in args["benchmarks"] or "draw" in args["benchmarks"]:
+			write_formats(source, annotations_dir, formats, resolution)
+		if "render" in args["benchmarks"]:
+			results.update(benchmark_render(video, annotations_dir, output_dir, formats, args["workers"], args["repeat"]))
+		if "draw" in args["benchmarks"]:
+			results.update(benchmark_draw(video, annotations_dir, output_dir, formats, args["frames"], args["draw_frames"], args["repeat"]))
+		if "detect" in args["benchmarks"]:
+			detect_video = os.path.join(work_dir, "detect.mp4")
+			write_synthetic_video(detect_video, store, args["fps"], args["detect_frames"], args["seed"])
+			results.update(benchmark_detect(detect_video, work_dir, args["min_size"], args["repeat"]))
+	finally:
+		if args["work_dir"] is None:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	config = {key: args[key] for key in ("width", "height", "frames", "objects", "fps", "seed", "repeat", "workers",
+		"draw_frames", "detect_frames", "min_size")}
+	return {"environment": environment(), "config": config, "results": results}
+
+
+
+def main(argv=None):
+	"""driver code: run the benchmarks according to the command line args (argv, by default sys.argv[1:])"""
+	args = vars(parser.parse_args(argv))
+	report = run(args)
+	with open(args["output"], "w") as f:
+		json.dump(report, f, indent=1)
+
+	for (name, result) in report["results"].items():
+		print("{:<44}{:>10.4f} s".format(name, result["seconds"]) + ("{:>12.2f} fps".format(result["fps"]) if "fps" in result else ""))
+	print("Report saved to " + args["output"])
+	if args["baseline"] is not None:
+		with open(args["baseline"]) as f:
+			print(compare(report, json.load(f)))
+	return 0
+
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -3,13 +3,28 @@ utils.py
 
 Functions to convert between various detection annotation formats
 
+Every conversion is a single pass: the input is read once into the canonical
+annotation_utils.AnnotationStore arrays (absolute xyxy boxes), and the output format
+is written straight from them. The rel/abs, xywh/xyxy and center/corner transforms
+run as vectorized numpy operations over all detections at once.
+See format specifications at the top of visual_utils.py
+
+Can be imported as a library (see convert()) or run as a script, see main()
 """
 
 import numpy as np
 import argparse
 import json
-import coco_names 
+import coco_names
 import os
+import annotation_utils
+import io
+import shutil
+import tarfile
+import sys
+import zipfile
+from video_utils import get_resolution
+from itertools import chain, repeat
 
 
 
@@ -17,353 +32,346 @@ import os
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', '--input', help='path to input annotations')
 parser.add_argument('-if', '--input_format', help='format of input annotations')
-parser.add_argument('-o', '--output', help='path to put output annotations at (typically a folder namee)')
+parser.add_argument('-o', '--output', help='path to put output annotations at (typically a folder namee, or a .zip/.tar/.tar.gz archive for the per-frame formats)')
 parser.add_argument('-of', '--output_format', help='desired format of output annotations')
 parser.add_argument("-cf", "--class_filter", nargs="+", default=[], help='optional list of class_ids for filter')
-args = vars(parser.parse_args())
+parser.add_argument('-v', '--video', help='optional path to the video the annotations belong to, used to get its resolution')
+parser.add_argument('-r', '--resolution', nargs=2, type=int, metavar=('W', 'H'), help='optional resolution of the video in pixels, if -v is not given')
+parser.add_argument('-w', '--workers', type=int, default=1, help='optional number of processes to split the conversion across')
 
 
-def get_resolution(video):
-	""" 
-	get the width and height of video (in pixels)
-	this is important for scaling to relative or absolute
-	coordinate formats for bounding boxes
-	"""
-	(W, H) = (None, None)
-	vidcap = cv2.VideoCapture(video)
-	success,image = vidcap.read()
-	(H, W) = image.shape[:2]   
-	return (H, W)
+#formats whose boxes are relative to the video resolution
+RELATIVE_FORMATS = annotation_utils.RELATIVE_FORMATS
 
+#formats written as a folder containing one frame<N>.txt file per frame
+FOLDER_FORMATS = ["yolo", "relxywh", "absxywh", "absolute"]
 
+#openimages label names indexed by class_id (the torchvision COCO categories, without __background__)
+CLASS_NAMES = coco_names.COCO_INSTANCE_CATEGORY_NAMES[1:]
 
 
-def opendatacamyolo_to_relxywh(yolo_anns, out_folder, class_filter):
-	"""Convert opendatacamyolo format to relxywh
-	with one file per frame
 
-	class_filter: List of coco_names indices. 
-	Only include annotations for objects whose class_id is in class_filter
+def _format_rows(row_format, columns):
 	"""
-
-	#make sure there is [ at the beginning, a ] at the end of the file, and no extraneous comma
-	opendatacam_anns = open(yolo_anns, "r").read()
-	opendatacam_anns = opendatacam_anns.replace("}, \n{", "},{")
-	final = ""
-	test = open("test", "w")
-	if opendatacam_anns[0] != "[":
-		final = "[" + opendatacam_anns[:-2] 
-	else:
-		final = opendatacam_anns[:-2] 
-
-	if opendatacam_anns[-2] == ",":
-		print("needs replacing")
-		final = final + "]"
-		test.write(final)
-
-
-	input_anns = json.loads(final)
-
-	for frame_data in input_anns:
-		frame_id = frame_data["frame_id"]
-		outfile = open(out_folder + "/frame" + str(frame_id) + ".txt", "w")
-		det_num = 1
-		for det in frame_data["objects"]:
-			width = det["relative_coordinates"]["width"]
-			height = det["relative_coordinates"]["height"]
-			center_x = det["relative_coordinates"]["center_x"]
-			center_y = det["relative_coordinates"]["center_y"]
-			if det_num != 1:
-				outfile.write("\n")
+	format all detections at once into a list of text lines,
+	columns being equal length lists of per-detection values
+	"""
+	num_rows = len(columns[0])
+	if num_rows == 0:
+		return []
+	values = tuple(chain.from_iterable(zip(*columns)))
+	return ((row_format + "\n") * num_rows % values).split("\n")[:-1]
 
 
-			class_id = det["class_id"]
-			if class_filter == [] or class_id in class_filter:	
-				new_line = str(class_id) + " " + str(det["confidence"]) + " " + str(center_x) + " " + str(center_y) + " " + str(width) + " " + str(height)
-				outfile.write(new_line)
-				det_num = det_num + 1
 
-		outfile.close()
+#output paths with these extensions are written as a single archive of frame<N>.txt files instead of a folder
+ARCHIVE_EXTENSIONS = [".zip", ".tar", ".tar.gz", ".tgz"]
 
-#opendatacamyolo_to_relxywh("timesquare-5-12-21.json", "timesquare-5-12-21-det-relxywh", [0])
 
 
+def is_archive(output):
+	return any(output.endswith(ext) for ext in ARCHIVE_EXTENSIONS)
 
 
 
-def faster_to_openimages(input_file, output_name):
+def _iter_frame_files(store, rows):
 	"""
-	convert json annotations outputted by my faster_rcnn implementation
-	to openimages format shown here: https://github.com/rafaelpadilla/review_object_detection_metrics/blob/main/data/database/gts/openimages_format/all_bounding_boxes.csv
+	yield (file name, contents) of the frame<N>.txt file of each frame the input of store listed
+	(empty for frames without detections, see AnnotationStore.frames_listed()),
+	rows being the already formatted text line of each detection in the store
 	"""
-	headers = "ImageID, Source, LabelName, Confidence, XMin, XMax, YMin, YMax, IsOccluded, IsTruncated, IsGroupOf, IsDepiction, IsInside"
-	output = open(output_name, "w")
-	output.write(headers + "\n")
-
-
-
-	faster_annotations = json.loads(open(input_file, "r").read())
-	for ann in faster_annotations:
-		in_image_id = ann["image_id"]
-		out_image_id = "frame" + str(ann["image_id"]) + ".jpg"
-
-		label_name = coco_names.COCO_INSTANCE_CATEGORY_NAMES[ann["category_id"]] 
-
-		confidence = ann["score"]
-
-		bbox = ann["bbox"]
-		xmin = bbox[0]
-		ymin = bbox[1]
-		xmax = bbox[2]
-		ymax = bbox[3]
-
-		row = out_image_id + ",," + label_name + "," + str(confidence) + "," + str(xmin) + "," + str(xmax) + "," + str(ymin) + "," + str(ymax) + ",,,,,\n"
-		output.write(row)
-
-	output.close()
+	for frame_id in store.frames_listed().tolist():
+		start = store.offsets[frame_id]
+		end = store.offsets[frame_id + 1]
+		yield ("frame" + str(frame_id) + ".txt", "\n".join(rows[start:end]))
 
 
 
+def _write_frame_archive(store, archive_name, rows):
+	"""
+	stream all frame<N>.txt files into a single zip or (optionally gzipped) tar file,
+	so the whole dataset is one sequential write
+	"""
+	if archive_name.endswith(".zip"):
+		with zipfile.ZipFile(archive_name, "w", zipfile.ZIP_DEFLATED) as archive:
+			for (name, contents) in _iter_frame_files(store, rows):
+				archive.writestr(name, contents)
+	else:
+		mode = "w|gz" if archive_name.endswith("gz") else "w|"
+		with tarfile.open(archive_name, mode) as archive:
+			for (name, contents) in _iter_frame_files(store, rows):
+				data = contents.encode()
+				info = tarfile.TarInfo(name)
+				info.size = len(data)
+				archive.addfile(info, io.BytesIO(data))
 
-#faster_to_openimages("timesquare-5-12-21-gt-faster.json")
 
 
-def openimages_to_yolo(input_anns, out_folder, class_filter):
+def _write_frame_folder(store, out_folder, rows):
 	"""
-	Convert openimages csv file to folder of yolo annotations 
-
-	IMPORTANT: Make sure (H, W) is correct for video. 
-	Use get_resolution() to confirm if needed
+	write one frame<N>.txt file per frame the input of store listed into out_folder
+	(or into a single archive if out_folder ends with one of ARCHIVE_EXTENSIONS),
+	rows being the already formatted text line of each detection in the store.
+	Each file is opened and written exactly once, from its in-memory batch of rows
 	"""
+	if is_archive(out_folder):
+		_write_frame_archive(store, out_folder, rows)
+		return
 
-	(H, W) = (720, 1280) #IMPORTANT
+	for (name, contents) in _iter_frame_files(store, rows):
+		with open(os.path.join(out_folder, name), "w") as outfile:
+			outfile.write(contents)
 
 
 
-	annotations = open(input_anns, "r")
-	headers = annotations.readline()
-	for line in annotations:
-		# if count > 3:
-		# 	break
-		data = line.split(",")
-	
-		image_id = int(data[0].split("frame")[1].split(".jpg")[0])
-		outfile = open(out_folder + "/frame" + str(image_id) + ".txt", "a")
+def write_relxywh(store, out_folder):
+	"""Write an AnnotationStore to a relxywh folder (class_id confidence rel_centerx rel_centery rel_width rel_height)"""
+	boxes = annotation_utils.absxyxy_to_relxywh(store.boxes, store.resolution)
+	rows = _format_rows("%d %f %f %f %f %f", [store.class_ids.tolist(), store.confidences.tolist()] + boxes.T.tolist())
+	_write_frame_folder(store, out_folder, rows)
 
 
-		xmin = int(data[4]) / W
-		xmax = int(data[5]) / W
-		ymin = int(data[6]) / H
-		ymax = int(data[7]) / H
 
-		width = xmax - xmin
-		height = ymax- ymin
+def write_absxywh(store, out_folder):
+	"""Write an AnnotationStore to an absxywh folder (class_id confidence abs_xmin abs_ymin abs_width abs_height)"""
+	boxes = annotation_utils.absxyxy_to_absxywh(store.boxes)
+	rows = _format_rows("%d %f %f %f %f %f", [store.class_ids.tolist(), store.confidences.tolist()] + boxes.T.tolist())
+	_write_frame_folder(store, out_folder, rows)
 
-		center_x = xmin + (width/2)
-		center_y = ymin + (height/2)
 
-		
-		class_id = coco_names.COCO_INSTANCE_CATEGORY_NAMES.index(data[2]) - 1 #adjust down because of extraneous inclusion of background
-		print(class_id)
-		
-		if class_filter == [] or class_id in class_filter:
-			new_line = str(class_id) + " " + str(center_x) + " " + str(center_y) + " " + str(width) + " " + str(height) + "\n"
-			outfile.write(new_line)
 
+def write_yolo(store, out_folder):
+	"""Write an AnnotationStore to a yolo folder (class_id rel_centerx rel_centery rel_width rel_height)"""
+	boxes = annotation_utils.absxyxy_to_relxywh(store.boxes, store.resolution)
+	rows = _format_rows("%d %f %f %f %f", [store.class_ids.tolist()] + boxes.T.tolist())
+	_write_frame_folder(store, out_folder, rows)
 
 
 
-#openimages_to_yolo("timesquare-5-12-21-gt-openimages.csv", "timesquare-5-12-2-gt-yolo")
+def write_absolute(store, out_folder):
+	"""Write an AnnotationStore to an absolute folder (class_id abs_xmin abs_ymin abs_xmax abs_ymax)"""
+	boxes = np.rint(store.boxes).astype(np.int64)
+	rows = _format_rows("%d %d %d %d %d", [store.class_ids.tolist()] + boxes.T.tolist())
+	_write_frame_folder(store, out_folder, rows)
 
 
 
-
-
-#evaluator doesn't like for some reason
-def opendatacamyolo_to_absxywh(yolo_anns, out_folder, class_filter):
-	"""Convert opendataccamyolo format to absxywh
-	with one file per frame
-	
-	
-	IMPORTANT: Make sure (H, W) is correct for video. 
-	Use get_resolution() to confirm if needed
+def write_openimages(store, output_name):
 	"""
+	Write an AnnotationStore to an openimages csv file, as shown here:
+	https://github.com/rafaelpadilla/review_object_detection_metrics/blob/main/data/database/gts/openimages_format/all_bounding_boxes.csv
+	"""
+	headers = "ImageID, Source, LabelName, Confidence, XMin, XMax, YMin, YMax, IsOccluded, IsTruncated, IsGroupOf, IsDepiction, IsInside"
+	label_names = np.array(CLASS_NAMES, dtype=object)[store.class_ids].tolist()
+	(xmin, ymin, xmax, ymax) = np.rint(store.boxes).astype(np.int64).T.tolist()
+	rows = _format_rows("frame%d.jpg,,%s,%f,%d,%d,%d,%d,,,,,",
+		[store.frame_ids.tolist(), label_names, store.confidences.tolist(), xmin, xmax, ymin, ymax])
+	with open(output_name, "w") as output:
+		output.write(headers + "\n")
+		output.write("".join(row + "\n" for row in rows))
 
 
-	(H, W) = (720, 1280) #IMPORTANT
 
+def write_faster(store, output_name):
+	"""
+	Write an AnnotationStore to a faster json file
+	(or a json lines file, gzipped or not, if output_name ends with .jsonl or .jsonl.gz)
+	"""
+	category_ids = store.class_ids + 1 #adjust up because of extraneous inclusion of background
+	#faster bboxes are integer pixel coordinates
+	boxes = np.rint(store.boxes).astype(np.int64).tolist()
+	with annotation_utils.FasterWriter(output_name) as writer:
+		for frame_id in store.frames_with_detections().tolist():
+			(first, last) = (store.offsets[frame_id], store.offsets[frame_id + 1])
+			writer.write_frame(frame_id, category_ids[first:last].tolist(), boxes[first:last], store.confidences[first:last].tolist())
 
 
-	#make sure there is [ at the beginning, a ] at the end of the file, and no extraneous comma
-	opendatacam_anns = open(yolo_anns, "r").read()
-	opendatacam_anns = opendatacam_anns.replace("}, \n{", "},{")
-	final = ""
 
-	if opendatacam_anns[0] != "[":
-		final = "[" + opendatacam_anns[:-2] 
-	else:
-		final = opendatacam_anns[:-2] 
+def write_opendatacamyolo(store, output_name):
+	"""
+	Write an AnnotationStore to an opendatacamyolo json file, naming each object as the input
+	named its class (objects of classes the input gave no name are written without a name)
+	"""
+	#opendatacam writes relative coordinates with 6 decimals, which also drops the float error of converting to and from pixels
+	boxes = np.round(annotation_utils.absxyxy_to_relxywh(store.boxes, store.resolution), 6).tolist()
+	class_ids = store.class_ids.tolist()
+	confidences = store.confidences.tolist()
+	class_names = store.class_names or {}
+	frames = []
+	for frame_id in store.frames_listed().tolist():
+		objects = []
+		for i in range(store.offsets[frame_id], store.offsets[frame_id + 1]):
+			(center_x, center_y, width, height) = boxes[i]
+			obj = {"class_id": class_ids[i]}
+			if class_ids[i] in class_names:
+				obj["name"] = class_names[class_ids[i]]
+			obj["relative_coordinates"] = {"center_x": center_x, "center_y": center_y, "width": width, "height": height}
+			obj["confidence"] = confidences[i]
+			objects.append(obj)
+		frames.append({"frame_id": frame_id, "objects": objects})
+	with open(output_name, "w") as outfile:
+		json.dump(frames, outfile)
+
+
+
+WRITERS = {
+	"relxywh": write_relxywh,
+	"absxywh": write_absxywh,
+	"yolo": write_yolo,
+	"absolute": write_absolute,
+	"openimages": write_openimages,
+	"faster": write_faster,
+	"opendatacamyolo": write_opendatacamyolo,
+	"binary": annotation_utils.save_binary,
+}
+
+
+
+def convert(input_anns, input_format, output, output_format, class_filter=[], resolution=None, workers=1):
+	"""
+	Convert annotations from any format annotation_utils.load_annotations() reads
+	to any format in WRITERS, in a single pass with no intermediate files
 
-	if opendatacam_anns[-2] == ",":
-		print("needs replacing")
-		final = final + "]"
+	input_anns: path to input annotations (file or folder depending on input_format)
+	output: path to output annotations (an existing folder or an archive name for FOLDER_FORMATS, a file otherwise)
+	class_filter: List of class_ids.
+	Only include annotations for objects whose class_id is in class_filter
+	resolution: (W, H) of the video in pixels, required if exactly one of the formats is in RELATIVE_FORMATS
+	(a binary input's own resolution is used if this is not given)
+	workers: number of processes to use. With more than one, the input is split into shards
+	(byte ranges at frame boundaries for the json/csv formats, frame ranges for the folder formats)
+	that are parsed in a process pool, and folder outputs are written by frame range in parallel.
+	The output is identical to the serial (workers=1) one
+	"""
+	if resolution is None and input_format in RELATIVE_FORMATS and output_format in RELATIVE_FORMATS:
+		#relative to relative does not depend on the resolution, with a unit one the boxes stay relative
+		resolution = (1, 1)
 
-	input_anns = json.loads(final)
+	if workers <= 1:
+		store = annotation_utils.load_annotations(input_anns, input_format, resolution)
+		_write(store, input_format, output, output_format, class_filter, resolution)
+		return
 
-	for frame_data in input_anns:
-		frame_id = frame_data["frame_id"]
-		outfile = open(out_folder + "/frame" + str(frame_id) + ".txt", "w")
-		det_num = 1
-		for det in frame_data["objects"]:
-			width = det["relative_coordinates"]["width"] * W
-			height = det["relative_coordinates"]["height"] * H
-			center_x = det["relative_coordinates"]["center_x"] * W
-			center_y = det["relative_coordinates"]["center_y"] * H
-			xmin = (center_x - (width/2)) 
-			ymin = (center_y - (height/2))
-			if det_num != 1:
-				outfile.write("\n")
+	#only pay for importing multiprocessing when converting in parallel
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(workers) as pool:
+		shards = annotation_utils.shard_annotations(input_anns, input_format, workers)
+		if shards == [None]:
+			store = annotation_utils.load_annotations(input_anns, input_format, resolution)
+		else:
+			stores = pool.map(annotation_utils.load_annotations, repeat(input_anns), repeat(input_format), repeat(resolution), shards)
+			store = annotation_utils.merge_stores(list(stores), resolution)
 
-			class_id = det["class_id"]
-			if class_filter == [] or class_id in class_filter:	
-				new_line = str(class_id) + " " + str(det["confidence"]) + " " + str(xmin) + " " + str(ymin) + " " + str(width) + " " + str(height)
-				outfile.write(new_line)
-				det_num = det_num + 1
+		if output_format in FOLDER_FORMATS and not is_archive(output):
+			#every frame file belongs to exactly one part, so parts can be written concurrently
+			parts = _prepare(store, input_format, output_format, class_filter, resolution).split_frames(workers)
+			list(pool.map(WRITERS[output_format], parts, repeat(output)))
+		else:
+			_write(store, input_format, output, output_format, class_filter, resolution)
 
-		outfile.close()
 
 
+def _prepare(store, input_format, output_format, class_filter, resolution):
+	"""apply the resolution and class filter of a conversion to the parsed store"""
+	if resolution is not None:
+		store.resolution = resolution
+	if store.resolution is None and (input_format in RELATIVE_FORMATS or output_format in RELATIVE_FORMATS):
+		raise ValueError("Converting " + input_format + " to " + output_format + " requires the video resolution")
+	return store.filter_classes(class_filter)
 
-def openimages_to_absolute(input_anns, out_folder):
-	"""
-	DEPRECATED - NOT TESTED, DON'T USE
-	Convert openimages csv file to folder of absolute annotations
 
-	IMPORTANT: Make sure (H, W) is correct for video. 
-	Use get_resolution() to confirm if needed
-	"""
 
+def _write(store, input_format, output, output_format, class_filter, resolution):
+	WRITERS[output_format](_prepare(store, input_format, output_format, class_filter, resolution), output)
 
-	(H, W) = (720, 1280) #IMPORTANT
 
 
+def opendatacamyolo_to_relxywh(yolo_anns, out_folder, class_filter, resolution):
+	"""Convert opendatacamyolo format to relxywh
+	with one file per frame
 
-	annotations = open(input_anns, "r")
-	headers = annotations.readline()
-	count = 0
-	for line in annotations:
-		# if count > 3:
-		# 	break
-		data = line.split(",")
-	
-		image_id = int(data[0].split("frame")[1].split(".jpg")[0])
-		outfile = open(out_folder + "/frame" + str(image_id) + ".txt", "a")
+	class_filter: List of coco_names indices.
+	Only include annotations for objects whose class_id is in class_filter
+	"""
+	convert(yolo_anns, "opendatacamyolo", out_folder, "relxywh", class_filter, resolution)
 
+#opendatacamyolo_to_relxywh("timesquare-5-12-21.json", "timesquare-5-12-21-det-relxywh", [0], (1280, 720))
 
-		xmin = int(data[4])
-		xmax = int(data[5])
-		ymin = int(data[6])
-		ymax = int(data[7])
 
-		width = xmax - xmin
-		height = ymax- ymin
 
-	
-		class_id = coco_names.COCO_INSTANCE_CATEGORY_NAMES.index(data[2])
-		print(class_id)
-		count = count + 1
-		new_line = str(class_id) + " " + str(xmin) + " " + str(ymin) + " " + str(width) + " " + str(height) + "\n"
-		outfile.write(new_line)
+#evaluator doesn't like for some reason
+def opendatacamyolo_to_absxywh(yolo_anns, out_folder, class_filter, resolution):
+	"""Convert opendataccamyolo format to absxywh
+	with one file per frame
+	"""
+	convert(yolo_anns, "opendatacamyolo", out_folder, "absxywh", class_filter, resolution)
 
 
 
+def faster_to_yolo(input_file, out_folder, class_filter, resolution):
+	"""
+	convert json annotations outputted by my faster_rcnn implementation
+	directly to a folder of yolo annotations (no openimages intermediate)
+	"""
+	convert(input_file, "faster", out_folder, "yolo", class_filter, resolution)
 
+#faster_to_yolo("timesquare-5-12-21-gt-faster.json", "timesquare-5-12-2-gt-yolo", [], (1280, 720))
 
-"""
-driver code
 
-call the appropriate functions according to command line args
-"""
 
-if args['input_format'] == "opendatacamyolo" and args['output_format'] == "relxywh":
-	#make sure path to input annotations provided is a file
-	file_exists = os.path.isfile(args["input"]) 
-	
 
-	#create output_folder if necessary
-	out_dir = args["output"]
-	dir_exists = os.path.isdir(out_dir + "/") 
-	if dir_exists:
-		#delete and recreate
-		os.system("rm -r " + out_dir)
-		os.system("mkdir " + out_dir )
-	else:
-		#just create
-		os.system("mkdir " + out_dir)
+def main(argv=None):
+	"""
+	driver code: call the appropriate functions according to the command line args
+	(argv, by default sys.argv[1:]), returns the exit status
+	"""
+	args = vars(parser.parse_args(argv))
 
-	class_filter = [int(i) for i in args["class_filter"]]
-	if file_exists:
-		opendatacamyolo_to_relxywh(args["input"], out_dir, class_filter)
-	else:
-		print("Invalid input file")
+	input_format = args['input_format']
+	output_format = args['output_format']
 
-elif args['input_format'] == "opendatacamyolo" and args['output_format'] == "absxywh":
-	#make sure path to input annotations provided is a file
-	file_exists = os.path.isfile(args["input"]) 
+	if input_format == "opendatacam_yolo":
+		input_format = "opendatacamyolo"
 
-	#create output_folder if necessary
-	out_dir = args["output"]
-	dir_exists = os.path.isdir(out_dir + "/") 
-	if dir_exists:
-		#delete and recreate
-		os.system("rm -r " + out_dir)
-		os.system("mkdir " + out_dir)
-	else:
-		#just create
-		os.system("mkdir " + out_dir)
+	if input_format not in annotation_utils.ANNOTATION_FORMATS or output_format not in WRITERS:
+		print("Unsupposrted conversion")
+		return 1
 
-	class_filter = [int(i) for i in args["class_filter"]]
-	if file_exists:
-		opendatacamyolo_to_absxywh(args["input"], out_dir, class_filter)
+	#make sure path to input annotations provided exists (a folder for FOLDER_FORMATS, a file otherwise)
+	if input_format in FOLDER_FORMATS:
+		input_exists = os.path.isdir(args["input"])
 	else:
+		input_exists = os.path.isfile(args["input"])
+	if not input_exists:
 		print("Invalid input file")
-
-elif args['input_format'] == "faster" and args['output_format'] == "yolo":
-	#make sure path to input annotations provided is a file
-	file_exists = os.path.isfile(args["input"]) 
-	if not file_exists:
-		print("Invalid input file")
-		exit()
-
-	faster_to_openimages(args["input"], "temp.csv")
-
-
-	#create output_folder if necessary
+		return 1
+
+	#get the real resolution of the video for the relative formats
+	resolution = None
+	if args["resolution"] is not None:
+		resolution = tuple(args["resolution"])
+	elif args["video"] is not None:
+		(H, W) = get_resolution(args["video"])
+		resolution = (W, H)
+	elif (input_format in RELATIVE_FORMATS) != (output_format in RELATIVE_FORMATS):
+		#a binary input may have been saved with its resolution (mapping it reads just the header)
+		if input_format != "binary" or annotation_utils.load_binary(args["input"]).resolution is None:
+			print("Converting " + input_format + " to " + output_format + " requires the video resolution, provide -v or -r")
+			return 1
+
+	#create output_folder if necessary (not needed when writing a single archive)
 	out_dir = args["output"]
-	dir_exists = os.path.isdir(out_dir + "/") 
-	if dir_exists:
-		#delete and recreate
-		os.system("rm -r " + out_dir)
-		os.system("mkdir " + out_dir)
-	else:
-		#just create
-		os.system("mkdir " + out_dir)
+	if output_format in FOLDER_FORMATS and not is_archive(out_dir):
+		if os.path.isdir(out_dir):
+			#delete and recreate
+			shutil.rmtree(out_dir)
+		os.makedirs(out_dir)
 
 	class_filter = [int(i) for i in args["class_filter"]]
-	print(class_filter)
-	openimages_to_yolo("temp.csv", out_dir, class_filter)
-
-	os.system("rm temp.csv")
-else:
-	print("Unsupposrted conversion")
-
-
-
-
-
-
-
-
+	convert(args["input"], input_format, out_dir, output_format, class_filter, resolution, args["workers"])
+	return 0
 
 
 
+if __name__ == "__main__":
+	sys.exit(main())
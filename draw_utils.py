@@ -0,0 +1,107 @@
+"""
+draw_utils.py
+
+Shared routine for drawing detection boxes and labels on frames,
+used by visual_utils.py and faster_rcnn/detect_utils.py
+"""
+
+import cv2
+import numpy as np
+from functools import lru_cache
+
+
+
+@lru_cache(maxsize=4096)
+def label_sprite(label, score, color, font_scale, thickness, line_type):
+	"""
+	Rasterize the label of a detection ("label" alone if score is None, "label: score" with the score
+	to 2 decimals otherwise) in color once and return (sprite, mask, alpha, height): the colored text image,
+	the uint8 mask of the pixels it touches, the float32 (H, W, 1) anti-aliased coverage of those pixels
+	(None if the text has no partially covered pixels), and the height of the sprite above the text baseline
+
+	Labels repeat constantly across frames (same class, same rounded confidence, same color),
+	so caching the rasterized text lets every later occurrence be a masked copy of a small
+	image instead of a cv2.putText call. Call it with the score already rounded to 2 decimals
+	so the cache is keyed on the label as drawn
+	"""
+	text = label if score is None else "{}: {:.2f}".format(label, score)
+	((text_w, text_h), baseline) = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+	pad = thickness
+	coverage = np.zeros((text_h + baseline + 2 * pad, text_w + 2 * pad), dtype=np.uint8)
+	cv2.putText(coverage, text, (pad, pad + text_h), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness, lineType=line_type)
+	mask = (coverage > 0).astype(np.uint8)
+	alpha = None
+	if np.any(mask & (coverage < 255)):
+		alpha = (coverage.astype(np.float32) / 255)[:, :, None]
+	sprite = np.empty(coverage.shape + (3,), dtype=np.uint8)
+	sprite[:] = color
+	return (sprite, mask, alpha, pad + text_h)
+
+
+
+def _blit_labels(image, labels, scores, origins, colors, font_scale, thickness, line_type):
+	"""
+	draw every label (with its score, if scores is not None) on image with its baseline starting
+	at the matching origin (as cv2.putText would), in the matching color, as copies of cached sprites
+	blended with their anti-aliased coverage
+	"""
+	(img_h, img_w) = image.shape[:2]
+	if scores is None:
+		scores = [None] * len(labels)
+	else:
+		scores = np.round(np.asarray(scores, dtype=np.float64), 2).tolist()
+	for (label, score, (x, y), color) in zip(labels, scores, origins.tolist(), colors):
+		(sprite, mask, alpha, height) = label_sprite(label, score, color, font_scale, thickness, line_type)
+		#top left corner of the sprite, clipped to the image
+		x -= thickness
+		y -= height
+		(x0, y0) = (max(x, 0), max(y, 0))
+		(x1, y1) = (min(x + sprite.shape[1], img_w), min(y + sprite.shape[0], img_h))
+		if x0 >= x1 or y0 >= y1:
+			continue
+		(sy, sx) = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+		if alpha is None:
+			cv2.copyTo(sprite[sy, sx], mask[sy, sx], image[y0:y1, x0:x1])
+		else:
+			region = image[y0:y1, x0:x1]
+			a = alpha[sy, sx]
+			region[:] = np.rint(region * (1 - a) + sprite[sy, sx] * a).astype(np.uint8)
+
+
+
+def draw_detections(image, boxes, labels, colors, scores=None, thickness=2, font_scale=0.5, line_type=cv2.LINE_8):
+	"""
+	Draw all boxes and their labels on image (in place) and return it
+
+	image: cv2-like BGR image
+	boxes: (N, 4) array of abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	labels: N labels (class names or ids, drawn just above each box), or None for no labels
+	colors: a single (B, G, R) color for all boxes, or an (N, 3) array with one color per box
+	scores: optional N confidences, drawn after each label rounded to 2 decimals
+	line_type: line type of the label text (boxes are always drawn with cv2.LINE_8, as cv2.rectangle does by default)
+	"""
+	boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int32)
+	if len(boxes) == 0:
+		return image
+
+	colors = np.asarray(colors, dtype=np.float64)
+	if colors.ndim == 1:
+		colors = np.broadcast_to(colors, (len(boxes), 3))
+
+	#every box as a closed 4 point polygon, so each color's boxes are drawn in a single call
+	(xmin, ymin, xmax, ymax) = boxes.T
+	polygons = np.stack([np.stack([xmin, ymin], 1), np.stack([xmax, ymin], 1),
+		np.stack([xmax, ymax], 1), np.stack([xmin, ymax], 1)], axis=1)
+	(unique_colors, color_index) = np.unique(colors, axis=0, return_inverse=True)
+	color_index = color_index.reshape(-1)
+	for (i, color) in enumerate(unique_colors):
+		color = tuple(float(c) for c in color)
+		cv2.polylines(image, list(polygons[color_index == i]), True, color, thickness)
+
+	if labels is not None and len(labels) > 0:
+		origins = np.stack([xmin, ymin - 5], axis=1)
+		#sprites are cached per color, so use integer colors as cache keys
+		label_colors = [tuple(color) for color in colors.astype(np.int32).tolist()]
+		_blit_labels(image, labels, scores, origins, label_colors, font_scale, thickness, line_type)
+
+	return image
@@ -0,0 +1,311 @@
+"""
+evaluate_annotations.py
+
+Evaluate detections against ground truth annotations, in any format annotation_utils.load_annotations()
+reads, without converting them for an external evaluation tool first
+
+Computes the COCO metrics (as pycocotools and review_object_detection_metrics do): AP averaged over
+the IoU thresholds 0.50:0.05:0.95, AP50, AP75, AP of small/medium/large objects, AR for 1/10/100
+detections per frame and class, plus the AP of every class and its precision-recall curves,
+all from a single matching pass over the frames
+
+Frames are images and the detections of each frame are matched to its ground truth of the same
+class greedily in descending confidence, each to the unmatched ground truth box it overlaps most
+"""
+
+import argparse
+import json
+import sys
+import numpy as np
+import annotation_utils
+
+
+
+COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+#precision-recall curves are interpolated at these recall levels
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+#COCO object sizes, by box area in pixels (both bounds included)
+AREA_RANGES = {"all": (0, np.inf), "small": (0, 32 ** 2), "medium": (32 ** 2, 96 ** 2), "large": (96 ** 2, np.inf)}
+#maximum numbers of detections per frame and class the average recall is computed for
+MAX_DETECTIONS = [1, 10, 100]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-g', '--ground_truth', required=True, help='path to the ground truth annotations')
+parser.add_argument('-gf', '--ground_truth_format', required=True, help='format of the ground truth annotations')
+parser.add_argument('-d', '--detections', required=True, help='path to the detections to evaluate')
+parser.add_argument('-df', '--detections_format', required=True, help='format of the detections')
+parser.add_argument('-v', '--video', help='optional path to the video the annotations belong to, used to get its resolution')
+parser.add_argument('-r', '--resolution', nargs=2, type=int, metavar=('W', 'H'), help='optional resolution of the video in pixels, if -v is not given')
+parser.add_argument("-cf", "--class_filter", nargs="+", type=int, default=[], help='optional list of class_ids to evaluate (default: all)')
+parser.add_argument('-o', '--output', help='optional path to save the metrics, per-class AP and precision-recall curves to as json')
+parser.add_argument('--full_curves', action='store_true', help='also save the raw (not interpolated) precision-recall curves')
+
+
+
+def _frame_slices(frame_ids):
+	#{frame: (start, end)} of an array sorted by frame
+	(frames, starts, counts) = np.unique(frame_ids, return_index=True, return_counts=True)
+	return dict(zip(frames.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+
+
+
+def _group_ranks(keys):
+	#position of every element within its run of equal keys, of an array sorted by key
+	if len(keys) == 0:
+		return np.zeros(0, dtype=np.int64)
+	starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+	return np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+
+
+
+def _areas(boxes):
+	return np.prod(np.clip(boxes[:, 2:] - boxes[:, :2], 0, None), axis=1)
+
+
+
+def _outside(areas, area_ranges):
+	#(A, N) whether each area is outside each of the A area ranges
+	return np.array([(areas < low) | (areas > high) for (low, high) in area_ranges]).reshape(len(area_ranges), len(areas))
+
+
+
+def match_detections(ground_truth, detections, iou_thresholds=COCO_IOU_THRESHOLDS, area_ranges=list(AREA_RANGES.values()), max_detections=100):
+	"""
+	Match the detections of every frame to the ground truth boxes of the same frame and class,
+	at every IoU threshold and for every area range at once
+
+	ground_truth, detections: AnnotationStores (boxes in absolute pixels)
+	area_ranges: list of (min, max) box areas, ground truth outside a range is ignored in it
+	(detections matching it, or unmatched and outside the range, are ignored too)
+	max_detections: only the most confident detections of each frame and class are evaluated
+
+	Returns (dt, gt_ignore, matched, dt_ignore):
+	dt: the evaluated detections as a dict of arrays "frame_ids", "class_ids", "confidences", "boxes" and "rank"
+	(position within its frame and class), sorted by frame, class and descending confidence
+	gt_ignore: (A, number of ground truth boxes) bool
+	matched: (A, T, number of detections) index (in ground_truth) of the box each detection matched, or -1
+	dt_ignore: (A, T, number of detections) bool
+	"""
+	thresholds = np.minimum(np.asarray(iou_thresholds, dtype=np.float64), 1 - 1e-10)
+
+	#detections by frame, class and descending confidence (ties keep their order), at most max_detections per frame and class
+	order = np.lexsort((-detections.confidences, detections.class_ids, detections.frame_ids))
+	num_classes = int(detections.class_ids.max()) + 1 if len(detections) else 1
+	keys = detections.frame_ids[order].astype(np.int64) * num_classes + detections.class_ids[order]
+	rank = _group_ranks(keys)
+	order = order[rank < max_detections]
+	dt = {"frame_ids": detections.frame_ids[order], "class_ids": detections.class_ids[order],
+		"confidences": detections.confidences[order], "boxes": detections.boxes[order], "rank": rank[rank < max_detections]}
+
+	gt_ignore = _outside(_areas(ground_truth.boxes), area_ranges)
+	dt_outside = _outside(_areas(dt["boxes"]), area_ranges)
+
+	#candidate (detection, ground truth) pairs: same frame and class, overlapping by at least the lowest threshold
+	pairs = ([], [], [])
+	gt_frames = _frame_slices(ground_truth.frame_ids)
+	for (frame, (dt_start, dt_end)) in _frame_slices(dt["frame_ids"]).items():
+		if frame not in gt_frames:
+			continue
+		(gt_start, gt_end) = gt_frames[frame]
+		ious = annotation_utils.box_iou(dt["boxes"][dt_start:dt_end], ground_truth.boxes[gt_start:gt_end])
+		ious[dt["class_ids"][dt_start:dt_end, None] != ground_truth.class_ids[None, gt_start:gt_end]] = 0
+		(rows, columns) = np.nonzero(ious >= thresholds.min())
+		pairs[0].append(rows + dt_start)
+		pairs[1].append(columns + gt_start)
+		pairs[2].append(ious[rows, columns])
+	(pair_dt, pair_gt, pair_iou) = (np.concatenate(p) if p else np.zeros(0) for p in pairs)
+	pair_dt = pair_dt.astype(np.int64)
+	pair_gt = pair_gt.astype(np.int64)
+
+	(A, T) = (len(area_ranges), len(thresholds))
+	matched = np.full((A, T, len(order)), -1, dtype=np.int64)
+	taken = np.zeros((A, T, len(ground_truth)), dtype=bool)
+	#detections are matched in descending confidence within their frame and class, but frames and classes are independent,
+	#so the k-th detections of all of them are matched at once, their pairs still sorted by detection and ground truth
+	pair_rank = dt["rank"][pair_dt]
+	by_rank = np.argsort(pair_rank, kind="stable")
+	for pairs_of_rank in np.split(by_rank, np.cumsum(np.bincount(pair_rank, minlength=1))[:-1]):
+		if len(pairs_of_rank) == 0:
+			continue
+		(dets, gts, ious) = (pair_dt[pairs_of_rank], pair_gt[pairs_of_rank], pair_iou[pairs_of_rank])
+		valid = ~taken[:, :, gts] & (ious[None, None, :] >= thresholds[None, :, None])
+		#prefer ground truth that is not ignored, then the highest IoU, then (as pycocotools) the last box
+		score = np.where(valid, ious + 2 * ~gt_ignore[:, None, gts], -1)
+		starts = np.flatnonzero(np.r_[True, dets[1:] != dets[:-1]])
+		segment = np.cumsum(np.r_[True, dets[1:] != dets[:-1]]) - 1
+		best = np.maximum.reduceat(score, starts, axis=2)
+		is_best = (score == best[:, :, segment]) & valid
+		last = np.maximum.reduceat(np.where(is_best, np.arange(len(dets)), -1), starts, axis=2)
+		(a, t, s) = np.nonzero(last >= 0)
+		matched[a, t, dets[starts[s]]] = gts[last[a, t, s]]
+		taken[a, t, gts[last[a, t, s]]] = True
+
+	#matched detections are ignored with their ground truth, unmatched ones if they are outside the area range
+	dt_ignore = np.broadcast_to(dt_outside[:, None, :], matched.shape).copy()
+	(a, t, d) = np.nonzero(matched >= 0)
+	dt_ignore[a, t, d] = gt_ignore[a, matched[a, t, d]]
+	return (dt, gt_ignore, matched, dt_ignore)
+
+
+
+def _interpolate(precision, recall):
+	"""
+	precision of (..., N) curves at each of the RECALL_THRESHOLDS, as the highest precision at that
+	recall or beyond (0 where the recall is never reached)
+	"""
+	shape = precision.shape[:-1]
+	num_points = precision.shape[-1]
+	if num_points == 0:
+		return np.zeros(shape + (len(RECALL_THRESHOLDS),))
+	precision = np.maximum.accumulate(precision[..., ::-1], axis=-1)[..., ::-1].reshape(-1, num_points)
+	recall = recall.reshape(-1, num_points)
+	#first point of each curve reaching each recall threshold (searched per curve, offsetting
+	#the curves to search them at once would round recalls right at a threshold)
+	index = np.array([np.searchsorted(curve, RECALL_THRESHOLDS, side="left") for curve in recall])
+	reached = index < num_points
+	interpolated = np.where(reached, np.take_along_axis(precision, np.minimum(index, num_points - 1), axis=1), 0.0)
+	return interpolated.reshape(shape + (len(RECALL_THRESHOLDS),))
+
+
+
+def evaluate(ground_truth, detections, iou_thresholds=COCO_IOU_THRESHOLDS, max_detections=MAX_DETECTIONS, full_curves=False):
+	"""
+	COCO evaluation of detections against ground_truth (AnnotationStores, boxes in absolute pixels)
+
+	Returns a dict of
+	- the summary metrics AP, AP50, AP75, APsmall, APmedium, APlarge, AR1, AR10, AR100, ARsmall, ARmedium, ARlarge
+	(None where there is no ground truth to compute them on)
+	- "per_class": {class name: {"class_id", "total_positives", "detections", "AP", "AP50", "AP75", "AR100", "AP_per_iou"}}
+	for every class in the ground truth or the detections
+	- "pr_curves": {class name: {"recall": RECALL_THRESHOLDS, "precision": [interpolated precision at each recall, per IoU threshold]}},
+	with full_curves also "raw": [{"precision": [...], "recall": [...], "confidence": [...]}, per IoU threshold]
+	- "iou_thresholds"
+	"""
+	iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+	max_detections = sorted(max_detections)
+	area_names = list(AREA_RANGES)
+	(dt, gt_ignore, matched, dt_ignore) = match_detections(ground_truth, detections, iou_thresholds,
+		list(AREA_RANGES.values()), max_detections[-1])
+
+	#classes are labelled with the names the inputs give them (see AnnotationStore.class_names), or their class_id
+	class_names = {**(detections.class_names or {}), **(ground_truth.class_names or {})}
+
+	#detections of each class in descending confidence, ties in frame order
+	order = np.lexsort((-dt["confidences"], dt["class_ids"]))
+	classes = np.union1d(ground_truth.class_ids, dt["class_ids"]).tolist()
+	class_starts = np.searchsorted(dt["class_ids"][order], classes, side="left")
+	class_ends = np.searchsorted(dt["class_ids"][order], classes, side="right")
+
+	(A, T, M, K) = (len(area_names), len(iou_thresholds), len(max_detections), len(classes))
+	#(A, T, K) AP and (A, T, M, K) recall, nan for classes without ground truth
+	ap = np.full((A, T, K), np.nan)
+	recall = np.full((A, T, M, K), np.nan)
+	per_class = {}
+	pr_curves = {}
+	for (k, class_id) in enumerate(classes):
+		in_class = order[class_starts[k]:class_ends[k]]
+		num_positives = np.count_nonzero(~gt_ignore[:, ground_truth.class_ids == class_id], axis=1)
+		is_matched = matched[:, :, in_class] >= 0
+		ignored = dt_ignore[:, :, in_class]
+		for (m, max_det) in enumerate(max_detections):
+			keep = dt["rank"][in_class] < max_det
+			#cumulative true and false positives in descending confidence (ignored detections are neither)
+			tp = np.cumsum(is_matched[:, :, keep] & ~ignored[:, :, keep], axis=2)
+			fp = np.cumsum(~is_matched[:, :, keep] & ~ignored[:, :, keep], axis=2)
+			precision = np.divide(tp, tp + fp, out=np.zeros(tp.shape), where=(tp + fp) > 0)
+			for a in range(A):
+				if num_positives[a] == 0:
+					continue
+				class_recall = tp[a] / num_positives[a]
+				recall[a, :, m, k] = class_recall[:, -1] if keep.any() else 0.0
+				if max_det == max_detections[-1]:
+					interpolated = _interpolate(precision[a], class_recall)
+					ap[a, :, k] = interpolated.mean(axis=1)
+					if area_names[a] == "all":
+						name = class_names.get(class_id, str(class_id))
+						pr_curves[name] = {"recall": RECALL_THRESHOLDS.tolist(), "precision": interpolated.round(6).tolist()}
+						if full_curves:
+							pr_curves[name]["raw"] = [{"precision": precision[a, t].tolist(), "recall": class_recall[t].tolist(),
+								"confidence": dt["confidences"][in_class][keep].tolist()} for t in range(T)]
+
+		per_class[class_names.get(class_id, str(class_id))] = {"class_id": class_id, "total_positives": int(num_positives[0]), "detections": len(in_class),
+			"AP": _mean(ap[0, :, k]), "AP50": _at_iou(ap[0, :, k], iou_thresholds, 0.5), "AP75": _at_iou(ap[0, :, k], iou_thresholds, 0.75),
+			"AR100": _mean(recall[0, :, -1, k]), "AP_per_iou": [None if np.isnan(x) else float(x) for x in ap[0, :, k]]}
+
+	results = {"AP": _mean(ap[0]), "AP50": _at_iou(ap[0], iou_thresholds, 0.5), "AP75": _at_iou(ap[0], iou_thresholds, 0.75)}
+	for a in range(1, A):
+		results["AP" + area_names[a]] = _mean(ap[a])
+	for (m, max_det) in enumerate(max_detections):
+		results["AR" + str(max_det)] = _mean(recall[0, :, m])
+	for a in range(1, A):
+		results["AR" + area_names[a]] = _mean(recall[a, :, -1])
+	results["iou_thresholds"] = iou_thresholds.round(4).tolist()
+	results["per_class"] = per_class
+	results["pr_curves"] = pr_curves
+	return results
+
+
+
+def _mean(values):
+	#mean of the values that are not nan, None if there are none
+	values = values[~np.isnan(values)]
+	return float(values.mean()) if len(values) else None
+
+
+
+def _at_iou(values, iou_thresholds, iou):
+	#_mean() of the values (first axis along the IoU thresholds) at one IoU threshold, None if it is not evaluated
+	matches = np.flatnonzero(np.isclose(iou_thresholds, iou))
+	return _mean(values[matches[0]]) if len(matches) else None
+
+
+
+def format_results(results):
+	"""the summary metrics and the AP of every class as a human readable table"""
+	lines = []
+	for name in ["AP", "AP50", "AP75", "APsmall", "APmedium", "APlarge", "AR1", "AR10", "AR100", "ARsmall", "ARmedium", "ARlarge"]:
+		if name in results:
+			lines.append("{:<10}{}".format(name, "-" if results[name] is None else "{:.4f}".format(results[name])))
+	lines.append("{:<16}{:>10}{:>12}{:>10}{:>10}{:>10}".format("class", "positives", "detections", "AP", "AP50", "AR100"))
+	for (name, metrics) in results["per_class"].items():
+		values = ["-" if metrics[key] is None else "{:.4f}".format(metrics[key]) for key in ("AP", "AP50", "AR100")]
+		lines.append("{:<16}{:>10}{:>12}{:>10}{:>10}{:>10}".format(name, metrics["total_positives"], metrics["detections"], *values))
+	return "\n".join(lines)
+
+
+
+def main(argv=None):
+	"""
+	driver code: evaluate the detections against the ground truth given by the
+	command line args (argv, by default sys.argv[1:])
+	"""
+	args = vars(parser.parse_args(argv))
+	for (name, annotation_format) in (("ground_truth", "ground_truth_format"), ("detections", "detections_format")):
+		if args[annotation_format] not in annotation_utils.ANNOTATION_FORMATS:
+			print("Unsupported " + name + " format " + args[annotation_format] + ", use one of " + ", ".join(annotation_utils.ANNOTATION_FORMATS))
+			return 1
+
+	#the relative formats need the resolution of the video
+	resolution = tuple(args["resolution"]) if args["resolution"] is not None else None
+	if args["video"] is not None:
+		from video_utils import get_resolution
+		(H, W) = get_resolution(args["video"])
+		resolution = (W, H)
+	relative = sorted(set(args[name] for name in ("ground_truth_format", "detections_format") if args[name] in annotation_utils.RELATIVE_FORMATS))
+	if resolution is None and len(relative) > 0:
+		print("Evaluating " + " and ".join(relative) + " annotations requires the video resolution, provide -v or -r")
+		return 1
+
+	ground_truth = annotation_utils.load_annotations(args["ground_truth"], args["ground_truth_format"], resolution).filter_classes(args["class_filter"])
+	detections = annotation_utils.load_annotations(args["detections"], args["detections_format"], resolution).filter_classes(args["class_filter"])
+	results = evaluate(ground_truth, detections, full_curves=args["full_curves"])
+	print(format_results(results))
+	if args["output"] is not None:
+		with open(args["output"], "w") as f:
+			json.dump(results, f)
+	return 0
+
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+check_cpu_optimized.py
+
+Compare the detections of the --cpu-optimized model (detect_utils.cpu_optimized_model)
+against the fp32 baseline on the first frames of a sample clip, and time both.
+
+Every baseline box scoring at least --threshold counts as reproduced if the optimized
+model has a box of the same class, with a score within --score-tolerance, overlapping
+it by at least --min-iou. Exits with status 1 if fewer than --min-match of the
+baseline boxes are reproduced.
+"""
+
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+import torch
+import torchvision
+import detect_utils
+
+# construct the argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', help='path to sample video clip')
+parser.add_argument('-m', '--min-size', dest='min_size', type=int, default=800,
+                    help='minimum input size for the FasterRCNN network')
+parser.add_argument('-n', '--frames', type=int, default=30,
+                    help='number of frames of the clip to compare on')
+parser.add_argument('-t', '--threshold', type=float, default=0.5,
+                    help='only compare baseline boxes scoring at least this much')
+parser.add_argument('--min-iou', dest='min_iou', type=float, default=0.9,
+                    help='minimum IoU of a reproduced box with its baseline box')
+parser.add_argument('--score-tolerance', dest='score_tolerance', type=float, default=0.05,
+                    help='maximum score difference of a reproduced box with its baseline box')
+parser.add_argument('--min-match', dest='min_match', type=float, default=0.95,
+                    help='minimum fraction of baseline boxes the optimized model has to reproduce')
+parser.add_argument('--no-quantize', dest='no_quantize', action='store_true',
+                    help='check the optimized model without int8 quantization')
+parser.add_argument('--threads', type=int, default=None,
+                    help='number of threads within an op (default: all cores)')
+parser.add_argument('--interop-threads', dest='interop_threads', type=int, default=None,
+                    help='number of threads across ops (default: 1)')
+args = vars(parser.parse_args())
+
+detect_utils.configure_cpu_threads(args['threads'], args['interop_threads'])
+device = torch.device('cpu')
+baseline = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True,
+                                                               min_size=args['min_size']).eval()
+optimized = detect_utils.cpu_optimized_model(args['min_size'], quantize=not args['no_quantize'])
+
+# read the sample frames
+cap = cv2.VideoCapture(args['input'])
+frames = []
+while len(frames) < args['frames']:
+    ret, frame = cap.read()
+    if ret == False:
+        break
+    frames.append(frame)
+cap.release()
+if not frames:
+    print('Error while trying to read video. Please check path again')
+    sys.exit(1)
+
+
+def run(model, context):
+    """detections (boxes, labels, scores) of model on every frame, and its frames per second"""
+    with context():
+        # the first runs of a TorchScript model optimize it, keep them out of the timing
+        detect_utils.predict_batch(frames[:1], model, device, 0.0)
+        detect_utils.predict_batch(frames[:1], model, device, 0.0)
+        start_time = time.time()
+        results = [detect_utils.predict_batch([frame], model, device, 0.0)[0] for frame in frames]
+        fps = len(frames) / (time.time() - start_time)
+    return [(boxes, labels.cpu().numpy(), scores) for (boxes, classes, labels, scores) in results], fps
+
+
+baseline_results, baseline_fps = run(baseline, torch.no_grad)
+optimized_results, optimized_fps = run(optimized, torch.inference_mode)
+
+num_boxes = 0
+matched_ious = []
+score_diffs = []
+for (base_boxes, base_labels, base_scores), (opt_boxes, opt_labels, opt_scores) in zip(baseline_results, optimized_results):
+    keep = base_scores >= args['threshold']
+    base_boxes, base_labels, base_scores = base_boxes[keep], base_labels[keep], base_scores[keep]
+    num_boxes += len(base_boxes)
+    if len(base_boxes) == 0 or len(opt_boxes) == 0:
+        continue
+    ious = torchvision.ops.box_iou(torch.as_tensor(base_boxes, dtype=torch.float32),
+                                   torch.as_tensor(opt_boxes, dtype=torch.float32)).numpy()
+    # candidate matches have the same class and a close enough score
+    ious[base_labels[:, None] != opt_labels[None, :]] = 0
+    ious[np.abs(base_scores[:, None] - opt_scores[None, :]) > args['score_tolerance']] = 0
+    best = ious.argmax(axis=1)
+    best_ious = ious[np.arange(len(base_boxes)), best]
+    matched = best_ious >= args['min_iou']
+    matched_ious.extend(best_ious[matched].tolist())
+    score_diffs.extend(np.abs(base_scores[matched] - opt_scores[best[matched]]).tolist())
+
+match_rate = len(matched_ious) / num_boxes if num_boxes else 1.0
+print(f"Compared {len(frames)} frames, {num_boxes} baseline boxes scoring at least {args['threshold']}")
+print(f"Reproduced: {len(matched_ious)} ({match_rate:.1%})")
+if matched_ious:
+    print(f"Mean IoU of reproduced boxes: {np.mean(matched_ious):.4f}, "
+          f"mean / max score difference: {np.mean(score_diffs):.4f} / {np.max(score_diffs):.4f}")
+print(f"Baseline FPS: {baseline_fps:.3f}, optimized FPS: {optimized_fps:.3f} ({optimized_fps / baseline_fps:.2f}x)")
+if match_rate < args['min_match']:
+    print(f"FAIL: fewer than {args['min_match']:.0%} of the baseline boxes reproduced")
+    sys.exit(1)
+print("PASS")
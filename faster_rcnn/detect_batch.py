@@ -0,0 +1,198 @@
+"""
+detect_batch.py
+
+Batch runner for detecting objects in many videos: takes a folder of videos (or a manifest
+listing one video path per line) and runs Faster R-CNN on them in N worker processes.
+Every worker loads its own copy of the model once and is pinned to its own share of the
+CPU cores, with torch using exactly that many threads, so workers never compete for cores.
+Videos are handed out from a queue, so a long video does not hold up the others.
+
+Annotations are written in the faster format to <output dir>/<video name>_<path hash>_<min size>-annotations.<format>,
+where <path hash> is a short hash of the absolute path of the video, so videos with the same name
+in different folders get their own annotations. They are written first under a .partial name
+that is renamed once the video is done, so a video whose annotations exist is complete and
+skipped when the runner is started again (e.g. after a crash).
+A summary of every video (frames, detections, frames per second, or the error it failed with)
+is printed and saved to <output dir>/batch-summary.json
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import queue
+import argparse
+import multiprocessing
+
+import detect_utils
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.mpg', '.mpeg', '.webm')
+
+# construct the argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', required=True,
+                    help='folder of videos, or manifest file listing one video path per line')
+parser.add_argument('-o', '--output-dir', dest='output_dir', default='outputs',
+                    help='folder to write the annotations and the summary to')
+parser.add_argument('-w', '--workers', type=int, default=1,
+                    help='number of worker processes, each with its own model')
+parser.add_argument('--threads', type=int, default=None,
+                    help='threads per worker (default: the cores of the machine split evenly between workers)')
+parser.add_argument('-m', '--min-size', dest='min_size', type=int, default=800,
+                    help='minimum input size for the FasterRCNN network')
+parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1,
+                    help='number of frames to run through the network in a single forward pass')
+parser.add_argument('-t', '--threshold', type=float, default=0.0,
+                    help='only keep detections scoring at least this much')
+parser.add_argument('-f', '--annotation-format', dest='annotation_format', default='json',
+                    choices=['json', 'jsonl', 'jsonl.gz'],
+                    help='write the annotations as one json list, or as json lines (one line per frame, optionally gzipped)')
+detect_utils.add_model_arguments(parser, threads=False)
+
+
+def list_videos(input_path):
+    """videos of a folder (sorted by name), or the paths listed in a manifest (skipping blank and # comment lines)"""
+    if os.path.isdir(input_path):
+        return sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                      if name.lower().endswith(VIDEO_EXTENSIONS))
+    videos = []
+    with open(input_path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                # relative paths are relative to the manifest
+                videos.append(os.path.join(os.path.dirname(os.path.abspath(input_path)), line))
+    return videos
+
+
+def output_name(video, output_dir, min_size, annotation_format):
+    """
+    path of the annotations of video: named like detect_vid.py names them, plus a short hash of
+    the absolute path of the video, so same-named videos from different folders don't collide
+    """
+    name = os.path.splitext(os.path.basename(video))[0]
+    path_hash = hashlib.sha1(os.path.abspath(video).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(output_dir, f"{name}_{path_hash}_{min_size}-annotations.{annotation_format}")
+
+
+def worker_cores(index, num_workers, threads=None):
+    """the cores worker index is pinned to: an even share of the cores this process may run on"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    per_worker = threads or max(1, len(cores) // num_workers)
+    first = (index * per_worker) % len(cores)
+    return [cores[(first + i) % len(cores)] for i in range(per_worker)]
+
+
+def worker(index, num_workers, args, jobs, results):
+    """
+    process videos from the jobs queue until None, putting a summary of each on the results queue
+    """
+    cores = worker_cores(index, num_workers, args['threads'])
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    # torch creates its thread pools lazily, so sizing them here, after pinning, gives each worker its own cores
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from annotation_utils import FasterWriter
+
+    detect_utils.configure_cpu_threads(len(cores), 1)
+    model, device, inference_context = detect_utils.load_model(args, configure_threads=False)
+
+    while True:
+        video = jobs.get()
+        if video is None:
+            break
+        output = output_name(video, args['output_dir'], args['min_size'], args['annotation_format'])
+        # insert .partial before the extension, which FasterWriter picks the format by
+        partial = output[:-len(args['annotation_format'])] + 'partial.' + args['annotation_format']
+        summary = {'input': video, 'output': output, 'worker': index}
+        start_time = time.time()
+        try:
+            with FasterWriter(partial) as annotations, inference_context():
+                frames, detections = detect_utils.detect_video(video, model, device, args['threshold'],
+                                                               annotations, args['batch_size'])
+            os.replace(partial, output)
+            seconds = time.time() - start_time
+            summary.update(status='done', frames=frames, detections=detections, seconds=seconds,
+                           fps=frames / seconds if seconds > 0 else 0.0)
+        except Exception as e:
+            summary.update(status='failed', error=f"{type(e).__name__}: {e}", seconds=time.time() - start_time)
+            if os.path.isfile(partial):
+                os.remove(partial)
+        results.put(summary)
+
+
+def run(args):
+    """run the batch described by the parsed command line args, returns the summary"""
+    os.makedirs(args['output_dir'], exist_ok=True)
+    videos = list_videos(args['input'])
+    summaries = []
+    todo = []
+    for video in videos:
+        output = output_name(video, args['output_dir'], args['min_size'], args['annotation_format'])
+        if os.path.isfile(output):
+            summaries.append({'input': video, 'output': output, 'status': 'skipped'})
+        else:
+            todo.append(video)
+
+    start_time = time.time()
+    num_workers = max(1, min(args['workers'], len(todo)))
+    if todo:
+        jobs = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        for video in todo:
+            jobs.put(video)
+        for _ in range(num_workers):
+            jobs.put(None)
+        workers = [multiprocessing.Process(target=worker, args=(i, num_workers, args, jobs, results), daemon=True)
+                   for i in range(num_workers)]
+        for process in workers:
+            process.start()
+
+        # collect a summary per video, until every video has one or every worker is gone
+        pending = set(todo)
+        while pending:
+            try:
+                summary = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in workers):
+                    break
+                continue
+            pending.discard(summary['input'])
+            print(f"{summary['input']}: {summary['status']}"
+                  + (f", {summary['frames']} frames at {summary['fps']:.2f} FPS" if summary['status'] == 'done'
+                     else f" ({summary['error']})"))
+            summaries.append(summary)
+        for process in workers:
+            process.join()
+        # videos whose worker died (e.g. killed for running out of memory) without reporting back
+        for video in todo:
+            if video in pending:
+                summaries.append({'input': video, 'status': 'failed', 'error': 'worker process died'})
+
+    elapsed = time.time() - start_time
+    done = [s for s in summaries if s['status'] == 'done']
+    frames = sum(s['frames'] for s in done)
+    summary = {
+        'videos': len(videos),
+        'done': len(done),
+        'skipped': sum(1 for s in summaries if s['status'] == 'skipped'),
+        'failed': sum(1 for s in summaries if s['status'] == 'failed'),
+        'workers': num_workers,
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        # in the order of the input
+        'per_video': sorted(summaries, key=lambda s: videos.index(s['input'])),
+    }
+    with open(os.path.join(args['output_dir'], 'batch-summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return summary
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    summary = run(args)
+    print(f"{summary['done']} videos done, {summary['skipped']} skipped, {summary['failed']} failed; "
+          f"{summary['frames']} frames in {summary['seconds']:.1f} s ({summary['fps']:.2f} FPS over {summary['workers']} workers)")
+    sys.exit(1 if summary['failed'] else 0)
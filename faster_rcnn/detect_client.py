@@ -0,0 +1,74 @@
+"""
+detect_client.py
+
+Thin command line client of detect_server.py: sends a detection job for each input
+to the running server and prints its summary. Only uses the standard library,
+so it starts instantly (no torch import, no model loading)
+"""
+
+import os
+import sys
+import json
+import argparse
+import urllib.error
+import urllib.request
+
+# construct the argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', nargs='+', required=True,
+                    help='path(s) to input images/videos')
+parser.add_argument('-o', '--output', default=None,
+                    help='path of the annotations (only with a single input, '
+                         'default: outputs/<input name>_<min size>-annotations.json on the server)')
+parser.add_argument('-t', '--threshold', type=float, default=0.0,
+                    help='only keep detections scoring at least this much')
+parser.add_argument('-m', '--min-size', dest='min_size', type=int, default=None,
+                    help="minimum input size for the FasterRCNN network (default: the server's)")
+parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1,
+                    help='number of video frames to run through the network in a single forward pass')
+parser.add_argument('--host', default='127.0.0.1',
+                    help='address of the detection server')
+parser.add_argument('-p', '--port', type=int, default=8765,
+                    help='port of the detection server')
+
+
+def submit(job, host='127.0.0.1', port=8765):
+    """
+    send a job (see detect_server.py) to the detection server and return its summary,
+    raises RuntimeError if the job failed
+    """
+    request = urllib.request.Request(f"http://{host}:{port}/detect", data=json.dumps(job).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get('error', str(e)))
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    if args['output'] is not None and len(args['input']) > 1:
+        print('-o can only be used with a single input')
+        sys.exit(1)
+
+    failed = 0
+    for input_path in args['input']:
+        # the server resolves paths relative to its own working directory
+        job = {'input': os.path.abspath(input_path), 'threshold': args['threshold'], 'batch_size': args['batch_size']}
+        if args['output'] is not None:
+            job['output'] = os.path.abspath(args['output'])
+        if args['min_size'] is not None:
+            job['min_size'] = args['min_size']
+        try:
+            result = submit(job, args['host'], args['port'])
+        except urllib.error.URLError as e:
+            print(f"Could not reach the detection server at {args['host']}:{args['port']} ({e.reason})")
+            sys.exit(1)
+        except RuntimeError as e:
+            print(f"{input_path}: {e}")
+            failed += 1
+            continue
+        print(f"{input_path}: {result['detections']} detections in {result['frames']} frames "
+              f"({result['seconds']:.2f} s) -> {result['output']}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,151 @@
+"""
+detect_server.py
+
+Long-running local detection service: loads Faster R-CNN once and runs detection jobs
+sent to it over HTTP, so short clips do not pay for importing torch and loading the model
+every time (see detect_client.py for the command line client)
+
+POST /detect with a json job
+    {"input": path to an image or video, "output": optional path of the annotations,
+     "threshold": 0.0, "min_size": 800, "batch_size": 1}
+writes the detections in the faster format (json lines if output ends with .jsonl or .jsonl.gz)
+and responds with
+    {"output": path, "frames": int, "detections": int, "seconds": float}
+or, if the job failed, {"error": message} with status 400 (bad job) or 500
+GET /health responds with {"status": "ok", "jobs": number of jobs run so far}
+
+Jobs run one at a time on the single resident model (concurrent requests wait for their turn).
+Paths are read and written by the server, so they are relative to its working directory
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import detect_utils
+from PIL import Image
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# annotation_utils lives in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from annotation_utils import FasterWriter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# construct the argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', default='127.0.0.1',
+                    help='address to listen on (only local clients by default)')
+parser.add_argument('-p', '--port', type=int, default=8765,
+                    help='port to listen on')
+parser.add_argument('-m', '--min-size', dest='min_size', type=int, default=800,
+                    help='default minimum input size for the FasterRCNN network, for jobs that do not set one')
+detect_utils.add_model_arguments(parser)
+
+
+class Detector:
+    """
+    the resident model, shared by all jobs
+    the eager model serves every min_size by changing the size its transform resizes to,
+    compiled (--cpu-optimized) models have it built in, so one is loaded per min_size
+    """
+
+    def __init__(self, args):
+        """args: the parsed command line args, see detect_utils.add_model_arguments()"""
+        self.args = args
+        self.cpu_optimized = args['cpu_optimized']
+        self.default_min_size = args['min_size']
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.compiled = {}
+        self.model, self.device, self.inference_context = detect_utils.load_model(args)
+        if self.cpu_optimized:
+            self.compiled[self.default_min_size] = self.model
+
+    def model_for(self, min_size):
+        if self.cpu_optimized:
+            if min_size not in self.compiled:
+                # the threads were configured when the first model was loaded
+                self.compiled[min_size] = detect_utils.load_model(self.args, min_size, configure_threads=False)[0]
+            return self.compiled[min_size]
+        self.model.transform.min_size = (min_size,)
+        return self.model
+
+    def run(self, job):
+        """run a job (see the top of this file) and return its summary, one job at a time"""
+        input_path = job['input']
+        threshold = float(job.get('threshold', 0.0))
+        min_size = int(job.get('min_size', self.default_min_size))
+        batch_size = max(1, int(job.get('batch_size', 1)))
+        output = job.get('output') or os.path.join(
+            'outputs', f"{os.path.splitext(os.path.basename(input_path))[0]}_{min_size}-annotations.json")
+        if not os.path.isfile(input_path):
+            raise ValueError(f"{input_path} does not exist")
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        with self.lock:
+            start_time = time.time()
+            model = self.model_for(min_size)
+            with FasterWriter(output) as annotations, self.inference_context():
+                if input_path.lower().endswith(IMAGE_EXTENSIONS):
+                    # images are passed as PIL images, as detect.py does
+                    image = Image.open(input_path).convert('RGB')
+                    frames = 1
+                    detections = detect_utils.detect_frames([image], model, self.device, threshold, annotations)
+                else:
+                    frames, detections = detect_utils.detect_video(input_path, model, self.device, threshold,
+                                                                   annotations, batch_size)
+            self.jobs += 1
+            seconds = time.time() - start_time
+        return {'output': output, 'frames': frames, 'detections': detections, 'seconds': seconds}
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': f"unknown path {self.path}"})
+            return
+        self.send_json(200, {'status': 'ok', 'jobs': detector.jobs})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self.send_json(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(job, dict) or 'input' not in job:
+                raise ValueError('a job needs an "input" path')
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            self.send_json(200, detector.run(job))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    detector = Detector(args)
+    server = ThreadingHTTPServer((args['host'], args['port']), DetectionHandler)
+    print(f"Detection server listening on http://{args['host']}:{args['port']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
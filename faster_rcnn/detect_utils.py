@@ -1,11 +1,25 @@
+import os
+import sys
+import torch
+import torchvision
 import torchvision.transforms as transforms
 import cv2
 import numpy
 import numpy as np
 from coco_names import COCO_INSTANCE_CATEGORY_NAMES as coco_names
 
+# the drawing routine is shared with visual_utils.py in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import draw_utils
+from annotation_utils import box_iou
+from timing_utils import StageTimer
+
 # this will help us create a different color for each class in coco_names
-COLORS = np.random.uniform(0, 255, size=(len(coco_names), 3))
+# (seeded, so a resumed detect_vid.py run draws every class in the same color as before)
+COLORS = np.random.RandomState(0).uniform(0, 255, size=(len(coco_names), 3))
+
+# stand-in for callers that do not time predict_batch()
+_NO_TIMER = StageTimer(enabled=False)
 
 # define the torchvision image transforms
 #this converts an input image to a tensor
@@ -14,11 +28,114 @@ transform = transforms.Compose([
 ])
 
 
+def configure_cpu_threads(num_threads=None, num_interop_threads=None):
+    """
+    set the number of threads torch uses within an op (e.g. one convolution) and across
+    independent ops, defaulting to every core within ops and a single inter-op thread
+    (the detector is one sequential chain of ops, extra inter-op threads only compete for cores)
+    must be called before the model runs for the first time
+    """
+    torch.set_num_threads(num_threads or os.cpu_count() or 1)
+    torch.set_num_interop_threads(num_interop_threads or 1)
+
+
+def cpu_optimized_model(min_size, quantize=True, cache_dir=None):
+    """
+    build fasterrcnn_resnet50_fpn for CPU inference: channels-last weights, Linear layers
+    (the box head) dynamically quantized to int8, compiled with TorchScript.
+    The compiled model is saved in cache_dir (by default next to the downloaded weights)
+    and loaded from there on later runs, without rebuilding or recompiling anything
+    Note the compiled model returns a (losses, detections) tuple, which predict() and predict_batch() accept
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(torch.hub.get_dir(), 'checkpoints')
+    cache_name = os.path.join(cache_dir, f"fasterrcnn_resnet50_fpn_{min_size}{'_int8' if quantize else ''}"
+                                         f"_torch{torch.__version__.split('+')[0]}.torchscript.pt")
+    if os.path.isfile(cache_name):
+        return torch.jit.load(cache_name, map_location='cpu').eval()
+
+    model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True, min_size=min_size)
+    model = model.eval().to(memory_format=torch.channels_last)
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model = torch.jit.script(model)
+    os.makedirs(cache_dir, exist_ok=True)
+    # save to a temporary file first, so concurrent runs never load a half written model
+    torch.jit.save(model, cache_name + '.tmp')
+    os.replace(cache_name + '.tmp', cache_name)
+    return model
+
+
+def random_model(min_size, seed=0):
+    """
+    tiny, randomly initialized Faster R-CNN (MobileNetV3 backbone, the COCO classes) for benchmarking
+    the detection pipeline offline on the CPU: nothing is downloaded and its detections are meaningless.
+    Every box is kept (no score threshold), so each frame has the full 100 detections to write and draw
+    """
+    # seeded without touching the global random state, so every run builds the same model
+    with torch.random.fork_rng(devices=[]):
+        torch.manual_seed(seed)
+        return torchvision.models.detection.fasterrcnn_mobilenet_v3_large_320_fpn(
+            weights=None, weights_backbone=None, num_classes=len(coco_names), min_size=min_size,
+            box_score_thresh=0.0)
+
+
+def add_model_arguments(parser, threads=True):
+    """
+    register the options choosing and configuring the model (see load_model()) on parser:
+    --cpu-optimized and --no-quantize, and --threads and --interop-threads unless threads is False
+    (for callers that size the torch thread pools themselves)
+    """
+    parser.add_argument('--cpu-optimized', dest='cpu_optimized', action='store_true',
+                        help='run a channels-last, int8 quantized, TorchScript compiled model on the CPU (see detect_utils.cpu_optimized_model)')
+    parser.add_argument('--no-quantize', dest='no_quantize', action='store_true',
+                        help='with --cpu-optimized, keep the fp32 weights')
+    if threads:
+        parser.add_argument('--threads', type=int, default=None,
+                            help='with --cpu-optimized, number of threads within an op (default: all cores)')
+        parser.add_argument('--interop-threads', dest='interop_threads', type=int, default=None,
+                            help='with --cpu-optimized, number of threads across ops (default: 1)')
+
+
+def load_model(args, min_size=None, configure_threads=True):
+    """
+    build the model the parsed args (see add_model_arguments()) ask for, at min_size (by default args['min_size'])
+    returns (model, device, inference_context), the model in eval mode on device, and the context to run it in
+    - --random-model (if the parser has it): random_model(), for benchmarking offline
+    - --cpu-optimized: cpu_optimized_model(), quantized unless --no-quantize, with the torch threads
+    configured from --threads and --interop-threads first (unless configure_threads is False)
+    - otherwise the pretrained fasterrcnn_resnet50_fpn, on the GPU if there is one
+    """
+    min_size = args['min_size'] if min_size is None else min_size
+    if args.get('random_model'):
+        model = random_model(min_size)
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        inference_context = torch.inference_mode
+    elif args['cpu_optimized']:
+        if configure_threads:
+            # threads have to be configured before torch runs anything
+            configure_cpu_threads(args.get('threads'), args.get('interop_threads'))
+        # load the compiled model from the cache, or build and compile it once
+        model = cpu_optimized_model(min_size, quantize=not args['no_quantize'])
+        device = torch.device('cpu')
+        inference_context = torch.inference_mode
+    else:
+        # download or load the model from disk
+        model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True, min_size=min_size)
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        inference_context = torch.no_grad
+    return (model.eval().to(device), device, inference_context)
+
+
+def _detections(outputs):
+    # TorchScript compiled detection models always return a (losses, detections) tuple
+    return outputs[1] if isinstance(outputs, tuple) else outputs
+
+
 def predict(image, model, device, detection_threshold):
     # transform the image to tensor
     image = transform(image).to(device)
-    image = image.unsqueeze(0) # add a batch dimension
-    outputs = model(image) # get the predictions on the image
+    outputs = _detections(model([image])) # get the predictions on the image (a batch of one)
     # print the results individually
     # print(f"BOXES: {outputs[0]['boxes']}")
     # print(f"LABELS: {outputs[0]['labels']}")
@@ -39,18 +156,162 @@ def predict(image, model, device, detection_threshold):
     return boxes, pred_classes, outputs[0]['labels'], ret_scores
 
 
+def predict_batch(images, model, device, detection_threshold, timer=None):
+    # optionally time the preprocess, forward and copy stages with a timing_utils.StageTimer
+    timer = timer or _NO_TIMER
+    with timer.stage('preprocess'):
+        # transform every image to a tensor, the model takes a list of (possibly differently sized) images
+        batch = [transform(image).to(device) for image in images]
+    with timer.stage('forward'):
+        outputs = _detections(model(batch)) # get the predictions for all images in a single forward pass
+        if timer.enabled and torch.device(device).type == 'cuda':
+            # CUDA runs asynchronously, wait for it so the forward pass is not counted as copying
+            torch.cuda.synchronize()
+    # split the outputs back into the per image results predict() returns
+    results = []
+    with timer.stage('copy'):
+        for output in outputs:
+            pred_classes = [coco_names[i] for i in output['labels'].cpu().numpy()]
+            pred_scores = output['scores'].detach().cpu().numpy()
+            pred_bboxes = output['boxes'].detach().cpu().numpy()
+            # get boxes above the threshold score
+            ret_scores = pred_scores[pred_scores >= detection_threshold]
+            boxes = pred_bboxes[pred_scores >= detection_threshold].astype(np.int32)
+            results.append((boxes, pred_classes, output['labels'], ret_scores))
+    return results
+
+
+def detect_frames(frames, model, device, detection_threshold, annotations, first_frame=0):
+    """
+    run a batch of frames through the model in one forward pass and write the
+    detections of each (numbered from first_frame) to annotations, a FasterWriter
+    returns the number of detections written
+    """
+    detections = 0
+    results = predict_batch(frames, model, device, detection_threshold)
+    for image_id, (boxes, classes, labels, scores) in enumerate(results, first_frame):
+        annotations.write_frame(image_id, labels[:len(boxes)].tolist(), boxes.tolist(), scores.tolist())
+        detections += len(boxes)
+    return detections
+
+
+def detect_video(input_path, model, device, detection_threshold, annotations, batch_size=1):
+    """
+    run the model on every frame of a video, batch_size frames at a time, and write the
+    detections to annotations (a FasterWriter), without drawing anything
+    returns (number of frames, number of detections)
+    call under torch.no_grad() or torch.inference_mode()
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError(f"{input_path} is not a readable video")
+    frames = detections = 0
+    batch = []
+    try:
+        while True:
+            ret, frame = cap.read()
+            if ret:
+                batch.append(frame)
+            if batch and (len(batch) == batch_size or not ret):
+                detections += detect_frames(batch, model, device, detection_threshold, annotations, frames)
+                frames += len(batch)
+                batch = []
+            if not ret:
+                break
+    finally:
+        cap.release()
+    return frames, detections
+
+
 def draw_boxes(boxes, classes, labels, image):
     # read the image with OpenCV
     image = cv2.cvtColor(np.asarray(image), cv2.COLOR_BGR2RGB)
-    for i, box in enumerate(boxes):
-        color = COLORS[labels[i]]
-        cv2.rectangle(
-            image,
-            (int(box[0]), int(box[1])),
-            (int(box[2]), int(box[3])),
-            color, 2
-        )
-        cv2.putText(image, classes[i], (int(box[0]), int(box[1]-5)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2, 
-                    lineType=cv2.LINE_AA)
-    return image
\ No newline at end of file
+    # labels may still be a tensor (possibly on the GPU)
+    labels = labels.cpu().numpy() if hasattr(labels, 'cpu') else np.asarray(labels)
+    labels = labels[:len(boxes)]
+    # draw all boxes at once, with cached label sprites instead of a putText per box
+    draw_utils.draw_detections(image, boxes, classes[:len(boxes)], COLORS[labels],
+                               thickness=2, font_scale=0.8, line_type=cv2.LINE_AA)
+    return image
+
+
+# width frames are downscaled to before computing optical flow between them
+FLOW_WIDTH = 320
+
+
+def flow_frame(frame):
+    """downscaled grayscale version of a frame for flow_shift_boxes(), and its scale"""
+    scale = min(1.0, FLOW_WIDTH / frame.shape[1])
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), scale
+
+
+def flow_shift_boxes(prev_gray, gray, scale, boxes):
+    """
+    move every abs_xmin abs_ymin abs_xmax abs_ymax box from the previous frame to the current one by the mean
+    dense optical flow (Farneback) inside it, given both frames as returned by flow_frame()
+    the mean flow of all boxes is read off integral images of the flow, so this costs the same for 1 or 1000 boxes
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return boxes
+    flow = cv2.calcOpticalFlowFarneback(prev_gray, gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    integral = cv2.integral(flow)
+    (h, w) = gray.shape
+    # box corners in the downscaled frame, every box at least one pixel large
+    x0 = np.clip(np.floor(boxes[:, 0] * scale).astype(np.int64), 0, w - 1)
+    y0 = np.clip(np.floor(boxes[:, 1] * scale).astype(np.int64), 0, h - 1)
+    x1 = np.clip(np.ceil(boxes[:, 2] * scale).astype(np.int64), x0 + 1, w)
+    y1 = np.clip(np.ceil(boxes[:, 3] * scale).astype(np.int64), y0 + 1, h)
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    shift = sums / ((x1 - x0) * (y1 - y0))[:, None] / scale
+    return boxes + np.tile(shift, 2)
+
+
+def match_detections(boxes_a, labels_a, boxes_b, labels_b, min_iou=0.3):
+    """
+    greedily pair the detections of two frames with the same label, highest IoU first
+    returns the (K,) indices into a and into b of the K pairs overlapping by at least min_iou
+    """
+    ious = box_iou(boxes_a, boxes_b)
+    ious[np.asarray(labels_a)[:, None] != np.asarray(labels_b)[None, :]] = 0
+    pairs_a = []
+    pairs_b = []
+    used_a = np.zeros(ious.shape[0], dtype=bool)
+    used_b = np.zeros(ious.shape[1], dtype=bool)
+    for index in np.argsort(-ious, axis=None, kind='stable'):
+        i, j = divmod(int(index), ious.shape[1])
+        if ious[i, j] < min_iou:
+            break
+        if not used_a[i] and not used_b[j]:
+            used_a[i] = used_b[j] = True
+            pairs_a.append(i)
+            pairs_b.append(j)
+    return np.array(pairs_a, dtype=np.int64), np.array(pairs_b, dtype=np.int64)
+
+
+def interpolate_detections(detections_a, detections_b, t):
+    """
+    detections (boxes, labels, scores) of a frame a fraction t of the way from a frame with detections_a
+    to a later frame with detections_b: boxes and scores of detections matched across both frames are
+    linearly interpolated, unmatched ones are taken from the nearer of the two frames
+    """
+    boxes_a, labels_a, scores_a = detections_a
+    boxes_b, labels_b, scores_b = detections_b
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    scores_a = np.asarray(scores_a, dtype=np.float64)
+    scores_b = np.asarray(scores_b, dtype=np.float64)
+    pairs_a, pairs_b = match_detections(boxes_a, labels_a, boxes_b, labels_b)
+    # unmatched detections of the nearer frame
+    if t < 0.5:
+        unmatched = np.setdiff1d(np.arange(len(boxes_a)), pairs_a)
+        near_boxes, near_labels, near_scores = boxes_a[unmatched], np.asarray(labels_a)[unmatched], scores_a[unmatched]
+    else:
+        unmatched = np.setdiff1d(np.arange(len(boxes_b)), pairs_b)
+        near_boxes, near_labels, near_scores = boxes_b[unmatched], np.asarray(labels_b)[unmatched], scores_b[unmatched]
+    boxes = np.concatenate([(1 - t) * boxes_a[pairs_a] + t * boxes_b[pairs_b], near_boxes])
+    labels = np.concatenate([np.asarray(labels_a)[pairs_a], near_labels]).astype(np.int64)
+    scores = np.concatenate([(1 - t) * scores_a[pairs_a] + t * scores_b[pairs_b], near_scores])
+    return boxes, labels, scores
@@ -1,127 +1,415 @@
-import torchvision
+import os
+import sys
 import cv2
-import torch
 import argparse
+import json
+import queue
+import threading
 import time
 import detect_utils
-import json
+import numpy as np
+from coco_names import COCO_INSTANCE_CATEGORY_NAMES as coco_names
 from PIL import Image
+
+# video_utils and annotation_utils live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from video_utils import probe_video
+from annotation_utils import FasterWriter, load_annotations
+from timing_utils import PROFILERS, StageTimer, profiling
+
 # construct the argument parser
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', '--input', help='path to input video')
-parser.add_argument('-m', '--min-size', dest='min_size', default=800, 
+parser.add_argument('-m', '--min-size', dest='min_size', type=int, default=800, 
                     help='minimum input size for the FasterRCNN network')
+parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1,
+                    help='number of frames to run through the network in a single forward pass')
+parser.add_argument('-q', '--queue-depth', dest='queue_depth', type=int, default=4,
+                    help='number of batches buffered between the decode, inference and draw stages')
+parser.add_argument('--no-video', dest='no_video', action='store_true',
+                    help='only write the annotations, without drawing or encoding an output video')
+parser.add_argument('-f', '--annotation-format', dest='annotation_format', default='json',
+                    choices=['json', 'jsonl', 'jsonl.gz'],
+                    help='write the annotations as one json list, or as json lines (one line per frame, optionally gzipped)')
+parser.add_argument('-k', '--keyframe-interval', dest='keyframe_interval', type=int, default=1,
+                    help='run the network on every k-th frame only, and propagate its boxes to the frames in between')
+parser.add_argument('--propagation', default='flow', choices=['flow', 'interpolate'],
+                    help='how boxes are propagated between keyframes: shifted by the optical flow from frame to frame, '
+                         'or linearly interpolated between the detections of the keyframes before and after')
+parser.add_argument('--motion-threshold', dest='motion_threshold', type=float, default=None,
+                    help='adaptive keyframes: also run the network as soon as the mean absolute pixel difference '
+                         'to the last keyframe exceeds this (0-255), making -k the maximum keyframe interval')
+parser.add_argument('--resume', action='store_true',
+                    help='continue an interrupted run from its checkpoint, appending to its annotations')
+detect_utils.add_model_arguments(parser)
+parser.add_argument('--random-model', dest='random_model', action='store_true',
+                    help='run a tiny, randomly initialized model instead, which needs no download '
+                         '(meaningless detections, for benchmarking the pipeline, see benchmark.py)')
+parser.add_argument('--quiet', action='store_true',
+                    help='do not print every detection, frame and batch, only the summary at the end')
+parser.add_argument('--timings', default=None,
+                    help='path of the json summary of the latency of every stage '
+                         '(default: outputs/<input name>_<min size>-timings.json)')
+parser.add_argument('--profile', default=None, choices=PROFILERS,
+                    help='run the inference loop under torch.profiler or cProfile (adds overhead)')
+parser.add_argument('--profile-output', dest='profile_output', default=None,
+                    help='path of the profile (default: outputs/<input name>_<min size>-profile.json for torch, .prof for cprofile)')
 args = vars(parser.parse_args())
-# download or load the model from disk
-model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True, 
-                                                    min_size=args['min_size'])
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+model, device, inference_context = detect_utils.load_model(args)
 
 
 cap = cv2.VideoCapture(args['input'])
 if (cap.isOpened() == False):
     print('Error while trying to read video. Please check path again')
-# get the frame width and height
-frame_width = int(cap.get(3))
-frame_height = int(cap.get(4))
+# get the frame width, height and fps from the (cached) container metadata
+metadata = probe_video(args['input'])
+frame_width = metadata['width']
+frame_height = metadata['height']
 save_name = f"{args['input'].split('/')[-1].split('.')[0]}_{args['min_size']}"
-# define codec and create VideoWriter object 
-out = cv2.VideoWriter(f"outputs/{save_name}.mp4", 
-                      cv2.VideoWriter_fourcc(*'mp4v'), 30, 
-                      (frame_width, frame_height))
+# define codec and create VideoWriter object (unless only the annotations are wanted)
+out = None
+if not args['no_video']:
+    out = cv2.VideoWriter(f"outputs/{save_name}.mp4", 
+                          cv2.VideoWriter_fourcc(*'mp4v'), metadata['fps'] or 30, 
+                          (frame_width, frame_height))
 
 
 
 frame_count = 0 # to count total frames
-total_fps = 0 # to get the final frames per second
-# load the model onto the computation device
-model = model.eval().to(device)
 
 
 
 
 
+# the annotations are streamed to disk a frame at a time as frames complete
 """
-[{
+json: [{
 "image_id": int, "category_id": int, "bbox": [x,y,width,height], "score": float,
 }]
+jsonl: one {"image_id": int, "detections": [{"category_id": int, "bbox": [...], "score": float}]} line per frame
+detections propagated from keyframes (see -k) also have "propagated": true
+"""
+output = "outputs/" + save_name + "-annotations." + args['annotation_format']
+
+# latency of every stage of the pipeline (decode, preprocess, forward, copy, propagate, write, draw, encode),
+# saved as json at the end of the run (see timing_utils.StageTimer)
+timer = StageTimer()
+timings_name = args['timings'] or "outputs/" + save_name + "-timings.json"
+profile_name = args['profile_output']
+if args['profile'] is not None and profile_name is None:
+    profile_name = "outputs/" + save_name + ("-profile.json" if args['profile'] == 'torch' else "-profile.prof")
+
+"""
+checkpoint of the run, rewritten after every batch: the last keyframe written, to continue from,
+and the position of the annotation output right before it
+(detections of the frames between keyframes depend on the keyframes around them, so a run can only resume at a keyframe)
+{"next_frame": int, "annotations_position": int}
+"""
+checkpoint_name = output + ".checkpoint"
+start_frame = 0
+resume_at = None
+if args['resume']:
+    if os.path.isfile(checkpoint_name):
+        with open(checkpoint_name) as f:
+            checkpoint = json.load(f)
+        start_frame = checkpoint['next_frame']
+        resume_at = checkpoint['annotations_position']
+        print(f"Resuming {output} at frame {start_frame}")
+    else:
+        print(f"No checkpoint {checkpoint_name} to resume from, starting at frame 0")
+annotations = FasterWriter(output, resume_at)
+
+
+def save_checkpoint(next_frame, position):
+    # write to a temporary file first, so a checkpoint is never left half written
+    with open(checkpoint_name + ".tmp", 'w') as f:
+        json.dump({"next_frame": next_frame, "annotations_position": position}, f)
+    os.replace(checkpoint_name + ".tmp", checkpoint_name)
+
+
+def render_previous_frames(num_frames):
+    """
+    when resuming, draw and write the frames before num_frames from the annotations
+    that were already written, without running the model, so the output video is complete
+    (an mp4 is unreadable until the VideoWriter is released, so nothing of it survives a crash)
+    """
+    previous = load_annotations(output, 'faster', None)
+    for frame_num in range(num_frames):
+        ret, frame = cap.read()
+        if ret == False:
+            break
+        class_ids, scores, boxes = previous.get_frame(frame_num)
+        labels = class_ids + 1 #adjust up because of extraneous inclusion of background
+        classes = [coco_names[label] for label in labels]
+        out.write(detect_utils.draw_boxes(boxes.astype('int32'), classes, labels, frame))
+
+
 """
-annotations = []
-
-
-# read until end of video
-while(cap.isOpened()):
-    # capture each frame of the video
-    ret, frame = cap.read()
-    if ret == True:
-        # get the start time
-        start_time = time.time()
-        with torch.no_grad():
-            # get predictions for the current frame
-            boxes, classes, labels, scores = detect_utils.predict(frame, model, device, 0.0)
-
-            #generate json objects in correct form for each frame
-            # print(boxes)
-            # print(classes)
-            # print(labels)
-            # print(scores)
-            for i in range(len(boxes)):
-                print(labels[i].item())
-                print(boxes[i].tolist())
-                print(scores[i])
-                data = {}
-                data['image_id'] = int(frame_count)
-                data['category_id'] = int(labels[i].item())
-                data["bbox"] = boxes[i].tolist()
-                data["score"] = float(scores[i])
-                annotations.append(data)
-
-        
-        # draw boxes and show current frame on screen
-        image = detect_utils.draw_boxes(boxes, classes, labels, frame)
-        # get the end time
-        end_time = time.time()
-        # get the fps
-        fps = 1 / (end_time - start_time)
-        print(fps)
-        # add fps to total fps
-        total_fps += fps
+The video is processed as a pipeline of three stages joined by bounded queues, so the
+model never waits for frames to be decoded or for results to be drawn and encoded:
+    decode thread: cap.read() frames into batches, picking keyframes -> frame_queue
+    main thread: model inference on the keyframes of each batch -> result_queue
+    postprocess thread: annotations.write_frame, draw_boxes and out.write, in the original frame order
+Each stage hands its batches on in the order it got them, so the output order is preserved.
+With -k 1 (the default) every frame is a keyframe.
+"""
+frame_queue = queue.Queue(maxsize=args['queue_depth'])
+result_queue = queue.Queue(maxsize=args['queue_depth'])
+stop = threading.Event()
+errors = []
+
+
+def put(q, item):
+    # block while the queue is full, but give up once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def get(q):
+    # block until an item is available, or return None once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def decode_frames():
+    """
+    read until end of video, putting (index of first frame, frames, keyframe flags) batches
+    holding batch_size keyframes (the last one possibly fewer) on frame_queue, then None
+
+    keyframes are every keyframe_interval-th frame of the video, and with a motion threshold
+    additionally every frame differing from the last keyframe by more than the threshold.
+    The first frame read is always a keyframe (also when resuming)
+    """
+    batch = []
+    keyframes = []
+    first_frame = start_frame
+    frame_num = start_frame
+    last_keyframe = None
+    try:
+        while not stop.is_set():
+            # capture each frame of the video
+            with timer.stage('decode'):
+                ret, frame = cap.read()
+            if ret == False:
+                break
+            is_keyframe = frame_num == start_frame or frame_num % args['keyframe_interval'] == 0
+            if args['motion_threshold'] is not None:
+                # compare downscaled grayscale frames, as for the optical flow
+                small, _ = detect_utils.flow_frame(frame)
+                if not is_keyframe:
+                    is_keyframe = cv2.absdiff(small, last_keyframe).mean() > args['motion_threshold']
+                if is_keyframe:
+                    last_keyframe = small
+            batch.append(frame)
+            keyframes.append(is_keyframe)
+            frame_num += 1
+            if sum(keyframes) == args['batch_size']:
+                put(frame_queue, (first_frame, batch, keyframes))
+                first_frame += len(batch)
+                batch = []
+                keyframes = []
+        # last, possibly smaller, batch
+        if batch:
+            put(frame_queue, (first_frame, batch, keyframes))
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        put(frame_queue, None)
+
+
+def postprocess():
+    """
+    write the annotations of each frame of every (first_frame, frames, keyframe flags, results) batch on
+    result_queue with its own image_id, and draw and write the frame, until None
+    the results of frames that are not keyframes are None, their detections are propagated from the keyframes
+    """
+    global frame_count
+    # detections (boxes, labels, scores) of the last keyframe and its image_id
+    keyframe_detections = None
+    keyframe_id = None
+    # detections shifted along with the optical flow up to the previous frame, and that frame (flow propagation)
+    tracked = None
+    prev_gray = None
+    # frames waiting for the detections of the next keyframe (interpolate propagation)
+    pending = []
+    # keyframe to resume from, and the position of the annotations before it
+    restart_point = None
+
+    def write(image_id, frame, detections, propagated):
+        global frame_count
+        boxes, labels, scores = detections
+        boxes = np.round(boxes).astype(np.int32)
+        with timer.stage('write'):
+            annotations.write_frame(image_id, labels.tolist(), boxes.tolist(), scores.tolist(), propagated)
+        if out is not None:
+            # draw boxes and write the current frame
+            # (no display window on Colab, so frames are not shown with cv2.imshow)
+            with timer.stage('draw'):
+                frame = detect_utils.draw_boxes(boxes, [coco_names[label] for label in labels], labels, frame)
+            with timer.stage('encode'):
+                out.write(frame)
         # increment frame count
         frame_count += 1
-        print(frame_count)
-        # press `q` to exit
-        wait_time = max(1, int(fps/4))
-        """
-        same issue as in detect.py - no display window on Colab
-        Can uncomment if running on actual machine tho
-        """
-        # cv2.imshow('image', image)
-
-        out.write(image)
-        if cv2.waitKey(wait_time) & 0xFF == ord('q'):
-            break
-    else:
-        break
+        if not args['quiet']:
+            print(frame_count)
 
+    def write_pending(next_detections, next_id):
+        # interpolate the waiting frames between the last keyframe and the next one
+        # (frames after the last keyframe of the video keep its detections)
+        for image_id, frame in pending:
+            if next_detections is None:
+                detections = keyframe_detections
+            else:
+                t = (image_id - keyframe_id) / (next_id - keyframe_id)
+                with timer.stage('propagate'):
+                    detections = detect_utils.interpolate_detections(keyframe_detections, next_detections, t)
+            write(image_id, frame, detections, True)
+        pending.clear()
 
-#convert and save annotations output 
-output = "outputs/" + save_name + "-annotations.json"
-with open(output, 'w') as outfile:
-    json.dump(annotations, outfile)
+    try:
+        while True:
+            item = get(result_queue)
+            if item is None:
+                break
+            first_frame, batch, keyframes, results = item
+            start_time = time.time()
+            for image_id, frame, is_keyframe, result in zip(
+                    range(first_frame, first_frame + len(batch)), batch, keyframes, results):
+                if args['propagation'] == 'flow' and args['keyframe_interval'] > 1:
+                    with timer.stage('propagate'):
+                        gray, scale = detect_utils.flow_frame(frame)
 
+                if is_keyframe:
+                    boxes, classes, labels, scores = result
+                    detections = (boxes, labels[:len(boxes)].cpu().numpy(), scores)
+                    #write the json objects of the frame in correct form
+                    if not args['quiet']:
+                        for i in range(len(boxes)):
+                            print(labels[i].item())
+                            print(boxes[i].tolist())
+                            print(scores[i])
+                    if pending:
+                        write_pending(detections, image_id)
+                    restart_point = (image_id, annotations.position)
+                    write(image_id, frame, detections, False)
+                    keyframe_detections = tracked = detections
+                    keyframe_id = image_id
+                elif args['propagation'] == 'flow':
+                    boxes, labels, scores = tracked
+                    with timer.stage('propagate'):
+                        tracked = (detect_utils.flow_shift_boxes(prev_gray, gray, scale, boxes), labels, scores)
+                    write(image_id, frame, tracked, True)
+                else:
+                    pending.append((image_id, frame))
 
+                if args['propagation'] == 'flow' and args['keyframe_interval'] > 1:
+                    prev_gray = gray
+            if restart_point is not None:
+                save_checkpoint(*restart_point)
+            if not args['quiet']:
+                print(f"postprocess: {len(batch) / (time.time() - start_time):.3f} FPS")
+        if pending:
+            write_pending(None, None)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
 
-# release VideoCapture()
-cap.release()
-# close all frames and video windows
-cv2.destroyAllWindows()
-# calculate and print the average FPS
-avg_fps = total_fps / frame_count
-print(f"Average FPS: {avg_fps:.3f}")
 
+# continue a resumed run at start_frame
+if start_frame > 0:
+    if out is not None:
+        render_previous_frames(start_frame)
+    else:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
 
+def key_pressed(wait_time):
+    # headless OpenCV builds (e.g. opencv-python-headless on servers) have no waitKey, so no `q` either
+    try:
+        return cv2.waitKey(wait_time) & 0xFF
+    except cv2.error:
+        return -1
 
 
+decoder = threading.Thread(target=decode_frames, daemon=True)
+writer = threading.Thread(target=postprocess, daemon=True)
+# get the start time
+start_time = time.time()
+inference_time = 0
+# whether the whole video was processed (rather than stopped with `q`)
+finished = False
+decoder.start()
+writer.start()
+try:
+    with profiling(args['profile'], profile_name):
+        while True:
+            item = get(frame_queue)
+            if item is None:
+                finished = True
+                break
+            first_frame, batch, keyframes = item
+            batch_start = time.time()
+            keyframe_results = iter([])
+            if any(keyframes):
+                with inference_context():
+                    # get predictions for all keyframes of the batch in one forward pass
+                    keyframe_results = iter(detect_utils.predict_batch(
+                        [frame for frame, is_keyframe in zip(batch, keyframes) if is_keyframe], model, device, 0.0,
+                        timer))
+            results = [next(keyframe_results) if is_keyframe else None for is_keyframe in keyframes]
+            batch_time = time.time() - batch_start
+            inference_time += batch_time
+            # get the fps of the network on this batch
+            fps = len(batch) / batch_time
+            if not args['quiet']:
+                print(fps)
+            put(result_queue, (first_frame, batch, keyframes, results))
+            # press `q` to exit
+            wait_time = max(1, int(fps/4))
+            if key_pressed(wait_time) == ord('q'):
+                break
+finally:
+    # let the postprocess thread finish the batches it already has, then stop the decoder
+    put(result_queue, None)
+    writer.join()
+    stop.set()
+    decoder.join()
+    # release VideoCapture() and VideoWriter()
+    cap.release()
+    if out is not None:
+        out.release()
+    annotations.close()
+if errors:
+    raise errors[0]
+end_time = time.time()
+# a completed run has nothing left to resume
+if finished and os.path.isfile(checkpoint_name):
+    os.remove(checkpoint_name)
 
 
+# close all frames and video windows
+try:
+    cv2.destroyAllWindows()
+except cv2.error:
+    pass
+# calculate and print the average FPS, of the network alone and of the whole pipeline
+# (a resumed run that was already complete, or an empty video, processes no frames at all)
+if frame_count == 0 or inference_time == 0:
+    print("No frames left to process")
+else:
+    print(f"Inference FPS: {frame_count / inference_time:.3f} (batch size {args['batch_size']})")
+    print(f"Average FPS: {frame_count / (end_time - start_time):.3f}")
+# per-stage latencies (stages run concurrently on the decode, main and postprocess threads)
+timer.save(timings_name, input=args['input'], frames=frame_count, batch_size=args['batch_size'],
+           keyframe_interval=args['keyframe_interval'])
+print(timer.format())
+print(f"Stage timings saved to {timings_name}")
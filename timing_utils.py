@@ -0,0 +1,157 @@
+"""
+timing_utils.py
+
+Low-overhead per-stage timers and optional profiler hooks for the detection
+(faster_rcnn/detect_vid.py) and rendering (visual_utils.create_annotated_video) loops
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+
+class StageTimer:
+	"""
+	Collects the latency of every run of each named stage of a loop (e.g. decode, forward, draw, encode),
+	possibly from several threads at once, and summarizes them as p50/p95/max/total per stage
+
+	Timing a stage costs two time.perf_counter() calls and a list append, so timers can stay on
+	in normal runs. A disabled timer (enabled=False) records nothing
+
+	usage:
+		timer = StageTimer()
+		with timer.stage("decode"):
+			ret, frame = cap.read()
+		...
+		timer.save("timings.json")
+	"""
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.durations = {}
+		self.lock = threading.Lock()
+		self.start_time = time.perf_counter()
+
+
+	@contextmanager
+	def stage(self, name):
+		"""time the body of the with statement as one run of stage name"""
+		if not self.enabled:
+			yield
+			return
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(name, time.perf_counter() - start)
+
+
+	def record(self, name, seconds):
+		"""add one run of stage name that took seconds"""
+		if not self.enabled:
+			return
+		durations = self.durations.get(name)
+		if durations is None:
+			with self.lock:
+				durations = self.durations.setdefault(name, [])
+		#list.append is atomic, so threads only need the lock to add a stage
+		durations.append(seconds)
+
+
+	def summary(self):
+		"""
+		Returns {"wall_s": seconds since the timer was created, "stages": {name: {"count", "total_s",
+		"mean_ms", "p50_ms", "p95_ms", "max_ms"}}}, stages in the order they first ran.
+		Stages running on different threads overlap, so their totals can add up to more than wall_s
+		"""
+		stages = {}
+		for (name, durations) in list(self.durations.items()):
+			durations = sorted(durations)
+			count = len(durations)
+			if count == 0:
+				continue
+			total = sum(durations)
+			stages[name] = {
+				"count": count,
+				"total_s": round(total, 6),
+				"mean_ms": round(1000 * total / count, 3),
+				"p50_ms": round(1000 * _percentile(durations, 50), 3),
+				"p95_ms": round(1000 * _percentile(durations, 95), 3),
+				"max_ms": round(1000 * durations[-1], 3),
+			}
+		return {"wall_s": round(time.perf_counter() - self.start_time, 6), "stages": stages}
+
+
+	def save(self, output_name, **extra):
+		"""write summary() (plus any extra keys, e.g. the number of frames) to output_name as json"""
+		summary = dict(extra, **self.summary())
+		with open(output_name, "w") as f:
+			json.dump(summary, f, indent=1)
+		return summary
+
+
+	def format(self):
+		"""summary() as a human readable table"""
+		summary = self.summary()
+		lines = ["{:<14}{:>8}{:>12}{:>12}{:>12}".format("stage", "count", "total s", "p50 ms", "p95 ms")]
+		for (name, stats) in summary["stages"].items():
+			lines.append("{:<14}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}".format(name, stats["count"], stats["total_s"], stats["p50_ms"], stats["p95_ms"]))
+		lines.append("wall time {:.3f} s".format(summary["wall_s"]))
+		return "\n".join(lines)
+
+
+
+def _percentile(sorted_values, percent):
+	#nearest-rank percentile of an already sorted, non-empty list
+	rank = max(1, -(-len(sorted_values) * percent // 100))
+	return sorted_values[int(rank) - 1]
+
+
+
+PROFILERS = ["torch", "cprofile"]
+
+
+
+@contextmanager
+def profiling(profiler=None, output_name=None):
+	"""
+	Run the body of the with statement under a profiler, if one is given
+	- "torch": torch.profiler (CPU, plus CUDA if available), the chrome trace is written to output_name
+	(open it in chrome://tracing or https://ui.perfetto.dev) and the top ops are printed
+	- "cprofile": cProfile, the stats are written to output_name (open them with pstats or snakeviz)
+	and the top functions by cumulative time are printed
+	- None: no profiling
+
+	Both profilers add noticeable overhead, so compare stage timings with profiling off.
+	cProfile only sees the thread it is started on
+	"""
+	if profiler is None:
+		yield
+		return
+
+	if profiler == "torch":
+		import torch
+		activities = [torch.profiler.ProfilerActivity.CPU]
+		if torch.cuda.is_available():
+			activities.append(torch.profiler.ProfilerActivity.CUDA)
+		with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+			yield
+		if output_name is not None:
+			prof.export_chrome_trace(output_name)
+		print(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=20))
+	elif profiler == "cprofile":
+		import cProfile
+		import pstats
+		prof = cProfile.Profile()
+		prof.enable()
+		try:
+			yield
+		finally:
+			prof.disable()
+			if output_name is not None:
+				prof.dump_stats(output_name)
+			pstats.Stats(prof).sort_stats("cumulative").print_stats(20)
+	else:
+		raise ValueError("Unsupported profiler " + str(profiler) + ", use one of " + ", ".join(PROFILERS))
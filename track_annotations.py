@@ -0,0 +1,277 @@
+"""
+track_annotations.py
+
+Multi-object tracker for the intercepted opendatacamyolo annotations, which (unlike the output of
+opendatacam's own tracker) have no track IDs or bearings, see the README
+
+Reads an opendatacamyolo json file as a stream of frames (so it also works on captures that are
+still being written or were cut off, see annotation_utils.iter_opendatacamyolo()) and writes it back
+with two extra fields on every object
+	"id": int, the same for every detection of the same object, across frames
+	"bearing": float, direction the object moves in, in degrees clockwise from up in the image
+	(0 = up, 90 = right, 180 = down, 270 = left, as in opendatacam), 0 until it has moved
+
+Detections are associated with the tracks of the previous frames in two stages, each as one
+vectorized step over all tracks and detections of the frame:
+1) by the IoU of the detection with the box the track is predicted at (its last box moved by its velocity)
+2) the leftovers by the distance between their centers, relative to the size of the track's box
+Each stage assigns greedily (best pair first), or optimally with the Hungarian algorithm (needs scipy)
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import annotation_utils
+
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', required=True, help='path to input opendatacamyolo annotations')
+parser.add_argument('-o', '--output', required=True, help='path to write the opendatacamyolo annotations with ids and bearings to')
+parser.add_argument('-v', '--video', help='path to the video the annotations belong to, used to get its resolution')
+parser.add_argument('-r', '--resolution', nargs=2, type=int, metavar=('W', 'H'), help='alternatively, the resolution of the video in pixels')
+parser.add_argument('--min_iou', type=float, default=0.3, help='minimum IoU of a detection with the predicted box of a track to continue it')
+parser.add_argument('--max_distance', type=float, default=1.0, help='maximum distance between the centers of a detection and a track (that did not overlap enough), relative to the size of the track box')
+parser.add_argument('--max_age', type=int, default=5, help='number of frames a track is kept without detections before it is dropped')
+parser.add_argument('--any_class', action='store_true', help='also continue tracks with detections of another class')
+parser.add_argument('--hungarian', action='store_true', help='assign detections to tracks optimally with the Hungarian algorithm instead of greedily (needs scipy)')
+
+
+
+def greedy_assignment(scores, valid):
+	"""
+	(rows, columns) of a one-to-one assignment of rows to columns, taking the valid pair
+	with the highest score first. Vectorized: every round takes all remaining pairs that are the
+	best of both their row and their column, which gives the same assignment as taking the best
+	remaining pair one at a time
+	"""
+	scores = np.where(valid, scores, -np.inf)
+	(rows, columns) = ([], [])
+	while scores.size:
+		best_columns = scores.argmax(axis=1)
+		best_rows = scores.argmax(axis=0)
+		row_indices = np.arange(scores.shape[0])
+		mutual = np.isfinite(scores[row_indices, best_columns]) & (best_rows[best_columns] == row_indices)
+		if not mutual.any():
+			break
+		(new_rows, new_columns) = (row_indices[mutual], best_columns[mutual])
+		rows.append(new_rows)
+		columns.append(new_columns)
+		scores[new_rows, :] = -np.inf
+		scores[:, new_columns] = -np.inf
+	if not rows:
+		return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+	return (np.concatenate(rows), np.concatenate(columns))
+
+
+
+def hungarian_assignment(scores, valid):
+	"""(rows, columns) of the valid one-to-one assignment of rows to columns with the highest total score"""
+	#scipy is only needed for optimal assignment
+	from scipy.optimize import linear_sum_assignment
+
+	if scores.size == 0:
+		return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+	#invalid pairs cost more than any assignment of valid ones, and are dropped afterwards
+	penalty = 1 + 2 * (np.abs(scores[valid]).max() if valid.any() else 0) * min(scores.shape)
+	(rows, columns) = linear_sum_assignment(np.where(valid, -scores, penalty))
+	keep = valid[rows, columns]
+	return (rows[keep], columns[keep])
+
+
+
+class Tracker:
+	"""
+	Assigns persistent ids to the detections of consecutive frames (see the top of this file)
+
+	All tracks are kept in parallel numpy arrays, so a frame costs a handful of array operations
+	on (tracks x detections) matrices, whatever the number of objects
+
+	min_iou: minimum IoU of a detection with the predicted box of a track to continue it
+	max_distance: maximum distance between the centers of a detection and the predicted box of a
+	track, relative to the larger side of the track box, to continue it if their IoU is too low
+	max_age: number of frames a track is kept (moving along with its velocity) without detections
+	match_classes: only continue tracks with detections of the same class
+	hungarian: assign optimally with the Hungarian algorithm (scipy) instead of greedily
+	smoothing: weight of the latest movement in the velocity of a track (exponential moving average)
+	min_speed: the bearing of a track is only updated while it moves at least this fast (pixels per frame)
+
+	usage:
+		tracker = Tracker()
+		for (boxes, class_ids) in frames:
+			(ids, bearings) = tracker.update(boxes, class_ids)
+	"""
+
+	def __init__(self, min_iou=0.3, max_distance=1.0, max_age=5, match_classes=True, hungarian=False, smoothing=0.5, min_speed=0.5):
+		self.min_iou = min_iou
+		self.max_distance = max_distance
+		self.max_age = max_age
+		self.match_classes = match_classes
+		self.assign = hungarian_assignment if hungarian else greedy_assignment
+		self.smoothing = smoothing
+		self.min_speed = min_speed
+		self.next_id = 0
+		#state of the active tracks
+		self.ids = np.zeros(0, dtype=np.int64)
+		self.boxes = np.zeros((0, 4))
+		self.class_ids = np.zeros(0, dtype=np.int64)
+		self.velocities = np.zeros((0, 2))
+		self.bearings = np.zeros(0)
+		self.ages = np.zeros(0, dtype=np.int64)
+
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def update(self, boxes, class_ids, frame_gap=1):
+		"""
+		Associate the detections of the next frame with the tracks
+
+		boxes: (N, 4) xmin ymin xmax ymax of the detections (in pixels, so bearings are not distorted)
+		class_ids: (N,) class of each detection
+		frame_gap: number of frames since the last update (more than 1 if frames were skipped)
+
+		Returns (ids, bearings), (N,) arrays with the track id and bearing of each detection
+		"""
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+
+		#move the tracks along with their velocity
+		predicted = self.boxes + np.tile(self.velocities * frame_gap, 2)
+		same_class = (self.class_ids[:, None] == class_ids[None, :]) if self.match_classes else np.ones((len(self), len(boxes)), dtype=bool)
+
+		#1) by overlap with the predicted boxes
+		ious = annotation_utils.box_iou(predicted, boxes)
+		(tracks, detections) = self.assign(ious, same_class & (ious >= self.min_iou))
+
+		#2) the remaining tracks and detections by the distance between their centers
+		track_left = np.ones(len(self), dtype=bool)
+		track_left[tracks] = False
+		detection_left = np.ones(len(boxes), dtype=bool)
+		detection_left[detections] = False
+		if track_left.any() and detection_left.any():
+			(left_tracks, left_detections) = (np.flatnonzero(track_left), np.flatnonzero(detection_left))
+			track_centers = _centers(predicted[left_tracks])
+			centers = _centers(boxes[left_detections])
+			sizes = np.maximum((predicted[left_tracks, 2:] - predicted[left_tracks, :2]).max(axis=1), 1e-9)
+			distances = np.linalg.norm(track_centers[:, None, :] - centers[None, :, :], axis=2) / sizes[:, None]
+			valid = same_class[np.ix_(left_tracks, left_detections)] & (distances <= self.max_distance)
+			(rows, columns) = self.assign(-distances, valid)
+			tracks = np.concatenate([tracks, left_tracks[rows]])
+			detections = np.concatenate([detections, left_detections[columns]])
+
+		#continue the matched tracks: smoothed velocity, and the bearing of their movement
+		movement = (_centers(boxes[detections]) - _centers(self.boxes[tracks])) / frame_gap
+		velocities = self.velocities.copy()
+		velocities[tracks] = self.smoothing * movement + (1 - self.smoothing) * self.velocities[tracks]
+		speeds = np.linalg.norm(velocities[tracks], axis=1)
+		moving = speeds >= self.min_speed
+		bearings = self.bearings.copy()
+		#clockwise from up, y grows downwards in images
+		bearings[tracks[moving]] = np.degrees(np.arctan2(velocities[tracks[moving], 0], -velocities[tracks[moving], 1])) % 360
+		track_boxes = predicted.copy()
+		track_boxes[tracks] = boxes[detections]
+		ages = self.ages + frame_gap
+		ages[tracks] = 0
+
+		#start a track for every detection left over, drop tracks unseen for more than max_age frames
+		new = np.ones(len(boxes), dtype=bool)
+		new[detections] = False
+		matched_ids = self.ids[tracks]
+		new_ids = np.arange(self.next_id, self.next_id + np.count_nonzero(new))
+		self.next_id += len(new_ids)
+		keep = ages <= self.max_age
+		self.ids = np.concatenate([self.ids[keep], new_ids])
+		self.boxes = np.concatenate([track_boxes[keep], boxes[new]])
+		self.class_ids = np.concatenate([self.class_ids[keep], class_ids[new]])
+		self.velocities = np.concatenate([velocities[keep], np.zeros((len(new_ids), 2))])
+		self.bearings = np.concatenate([bearings[keep], np.zeros(len(new_ids))])
+		self.ages = np.concatenate([ages[keep], np.zeros(len(new_ids), dtype=np.int64)])
+
+		ids = np.empty(len(boxes), dtype=np.int64)
+		ids[detections] = matched_ids
+		ids[new] = new_ids
+		detection_bearings = np.zeros(len(boxes))
+		detection_bearings[detections] = bearings[tracks]
+		return (ids, detection_bearings)
+
+
+
+def _centers(boxes):
+	return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+
+
+def track_frames(frames, resolution, **tracker_options):
+	"""
+	Track the objects of a stream of opendatacamyolo frame dicts ({"frame_id": x, "objects": [...]},
+	e.g. from annotation_utils.iter_opendatacamyolo()), yielding each frame with "id" and "bearing"
+	added to its objects, as soon as it is tracked
+
+	resolution: (W, H) of the video in pixels, boxes are tracked in pixels so bearings are not distorted
+	tracker_options: passed on to Tracker
+	"""
+	tracker = Tracker(**tracker_options)
+	scale = np.array(resolution, dtype=np.float64)
+	previous_frame = None
+	for frame in frames:
+		objects = frame.get("objects", [])
+		coordinates = np.array([[o["relative_coordinates"][key] for key in ("center_x", "center_y", "width", "height")] for o in objects], dtype=np.float64).reshape(-1, 4)
+		centers = coordinates[:, :2] * scale
+		sizes = coordinates[:, 2:] * scale
+		boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+		class_ids = [o["class_id"] for o in objects]
+		frame_gap = 1 if previous_frame is None else max(1, frame["frame_id"] - previous_frame)
+		previous_frame = frame["frame_id"]
+
+		(ids, bearings) = tracker.update(boxes, class_ids, frame_gap)
+		for (o, object_id, bearing) in zip(objects, ids.tolist(), bearings.round(2).tolist()):
+			o["id"] = object_id
+			o["bearing"] = bearing
+		yield frame
+
+
+
+def main(argv=None):
+	"""driver code: track the annotations given by the command line args (argv, by default sys.argv[1:])"""
+	args = vars(parser.parse_args(argv))
+	if args["video"] is not None:
+		from video_utils import get_resolution
+		(H, W) = get_resolution(args["video"])
+		resolution = (W, H)
+	elif args["resolution"] is not None:
+		resolution = tuple(args["resolution"])
+	else:
+		print("The resolution of the video is required to track opendatacamyolo annotations, use -v or -r")
+		return 1
+	if args["hungarian"]:
+		try:
+			import scipy.optimize
+		except ImportError:
+			print("--hungarian requires scipy (pip install scipy)")
+			return 1
+
+	start_time = time.time()
+	frame_count = 0
+	track_count = 0
+	#write every frame as soon as it is tracked
+	with open(args["output"], "w") as out:
+		out.write("[")
+		for frame in track_frames(annotation_utils.iter_opendatacamyolo(args["input"]), resolution, min_iou=args["min_iou"],
+				max_distance=args["max_distance"], max_age=args["max_age"], match_classes=not args["any_class"], hungarian=args["hungarian"]):
+			out.write(",\n" if frame_count else "\n")
+			json.dump(frame, out)
+			frame_count += 1
+			track_count = max([track_count] + [o["id"] + 1 for o in frame["objects"]])
+		out.write("\n]\n")
+	elapsed = time.time() - start_time
+	print("Tracked " + str(track_count) + " objects over " + str(frame_count) + " frames at " + str(round(frame_count / elapsed if elapsed > 0 else 0.0, 2)) + " frames per second")
+	return 0
+
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,8 +1,23 @@
+"""
+video_utils.py
+
+Functions for probing, decomposing and recomposing videos
+"""
+
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+
+
 def decompose(video, out_folder):
 	"""
 	get all frames for video
 	and store each as a jpg in out_folder
 	"""
+	import cv2
 	
 	vidcap = cv2.VideoCapture(video)
 	success,image = vidcap.read()
@@ -30,3 +45,161 @@ def recompose(frame_folder, output_name):
 	NOTE: Must have ffmpeg installed on machine
 	"""
 	os.system("ffmpeg  -i " + frame_folder + "/img%d.png " + output_name + ".mp4")
+
+
+
+
+#boxes of an mp4/mov file that only contain other boxes, on the way to the sample tables
+_MP4_CONTAINER_BOXES = (b"moov", b"trak", b"mdia", b"minf", b"stbl")
+
+
+
+def _iter_mp4_boxes(f, start, end):
+	"""yield (type, payload start, payload end) of the boxes of an mp4/mov file between start and end"""
+	pos = start
+	while pos + 8 <= end:
+		f.seek(pos)
+		(size, box_type) = struct.unpack(">I4s", f.read(8))
+		header = 8
+		if size == 1:
+			size = struct.unpack(">Q", f.read(8))[0]
+			header = 16
+		elif size == 0:
+			size = end - pos
+		if size < header:
+			return
+		yield (box_type, pos + header, pos + size)
+		pos += size
+
+
+
+def _mp4_video_tables(f, start, end, tables):
+	"""collect the hdlr handler type, stss and stsz payloads of each track into tables"""
+	for (box_type, payload_start, payload_end) in _iter_mp4_boxes(f, start, end):
+		if box_type == b"trak":
+			track = {}
+			_mp4_video_tables(f, payload_start, payload_end, track)
+			tables.setdefault("tracks", []).append(track)
+		elif box_type in _MP4_CONTAINER_BOXES:
+			_mp4_video_tables(f, payload_start, payload_end, tables)
+		elif box_type == b"hdlr":
+			f.seek(payload_start + 8)
+			tables["handler"] = f.read(4)
+		elif box_type in (b"stss", b"stsz"):
+			f.seek(payload_start)
+			tables[box_type] = f.read(payload_end - payload_start)
+
+
+
+def _mp4_keyframes(video):
+	"""
+	read the zero-indexed keyframe numbers of the video track of an mp4/mov file
+	from its sync sample (stss) table, without decoding anything.
+	Returns None if the file is not an mp4/mov or has no video track
+	"""
+	try:
+		with open(video, "rb") as f:
+			tables = {}
+			_mp4_video_tables(f, 0, os.path.getsize(video), tables)
+	except (OSError, struct.error):
+		return None
+
+	for track in tables.get("tracks", []):
+		if track.get("handler") != b"vide":
+			continue
+		if b"stss" in track:
+			count = struct.unpack(">I", track[b"stss"][4:8])[0]
+			samples = struct.unpack(">%dI" % count, track[b"stss"][8:8 + 4 * count])
+			return [sample - 1 for sample in samples]
+		if b"stsz" in track:
+			#no sync sample table means every frame is a keyframe
+			count = struct.unpack(">I", track[b"stsz"][8:12])[0]
+			return list(range(count))
+	return None
+
+
+
+def _ffprobe(video):
+	"""read width, height, fps and frame count of the first video stream with ffprobe, or None if unavailable"""
+	if shutil.which("ffprobe") is None:
+		return None
+	try:
+		result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+			"stream=width,height,avg_frame_rate,nb_frames", "-of", "json", video], capture_output=True, check=True)
+		stream = json.loads(result.stdout)["streams"][0]
+	except (subprocess.CalledProcessError, KeyError, IndexError, ValueError):
+		return None
+
+	(num, den) = stream.get("avg_frame_rate", "0/1").split("/")
+	frame_count = stream.get("nb_frames")
+	return {
+		"width": int(stream["width"]),
+		"height": int(stream["height"]),
+		"fps": float(num) / float(den) if float(den) != 0 else 0.0,
+		"frame_count": int(frame_count) if frame_count not in (None, "N/A") else None,
+	}
+
+
+
+def _cv2_probe(video):
+	"""read width, height, fps and frame count from the container through OpenCV, without decoding a frame"""
+	import cv2
+
+	vidcap = cv2.VideoCapture(video)
+	metadata = {
+		"width": int(vidcap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+		"height": int(vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+		"fps": float(vidcap.get(cv2.CAP_PROP_FPS)),
+		"frame_count": int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT)),
+	}
+	vidcap.release()
+	return metadata
+
+
+
+def probe_video(video, use_cache=True):
+	"""
+	get the metadata of video without decoding any pixels:
+	{"width", "height", "fps", "frame_count", "keyframes"}
+	keyframes is the sorted list of zero-indexed keyframe numbers, or None if unknown
+
+	The result is cached in a sidecar file <video>.meta.json, keyed by the video's path, size and
+	modification time, so probing the same video again only reads that small file
+	"""
+	stat = os.stat(video)
+	key = {"path": os.path.abspath(video), "size": stat.st_size, "mtime": stat.st_mtime}
+	sidecar = video + ".meta.json"
+
+	if use_cache and os.path.isfile(sidecar):
+		try:
+			with open(sidecar, "r") as f:
+				cached = json.load(f)
+			if cached.get("key") == key:
+				return cached["metadata"]
+		except (OSError, ValueError):
+			pass
+
+	metadata = _ffprobe(video)
+	if metadata is None:
+		metadata = _cv2_probe(video)
+	metadata["keyframes"] = _mp4_keyframes(video)
+
+	if use_cache:
+		try:
+			with open(sidecar, "w") as f:
+				json.dump({"key": key, "metadata": metadata}, f)
+		except OSError:
+			#e.g. read-only video folder, just don't cache
+			pass
+	return metadata
+
+
+
+def get_resolution(video):
+	""" 
+	get the width and height of video (in pixels)
+	this is important for scaling to relative or absolute
+	coordinate formats for bounding boxes
+	"""
+	metadata = probe_video(video)
+	return (metadata["height"], metadata["width"])
@@ -2,18 +2,25 @@
 utils.py
 
 Various utility functions to aid in visualizing videos and detection annotations
+
+Can be imported as a library (OpenCV is only imported once a function that reads,
+draws or writes frames is called), or run as a script, see main()
 """
 
 
-import numpy as np
 import argparse
-import imutils
 import time
-import cv2
 import os
-import json
-import coco_names 
-import glob
+import queue
+import shutil
+import sys
+import threading
+import annotation_utils
+import bisect
+import timing_utils
+from video_utils import probe_video
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 """
@@ -75,6 +82,11 @@ These formats were all established in various previous papers or common detectio
 		{"image_id": 0, "category_id": 1, "bbox": [abs_xmin, abs_ymin, abs_xmax, abs_ymax], "confidence_score": 0.9972374439239502},....
 	]
 	image_id should be the frame number in the video (zero-indexed)
+	or (files ending in .jsonl, or .jsonl.gz when gzipped) json lines with one line per frame of the form
+		{"image_id": 0, "detections": [{"category_id": 1, "bbox": [abs_xmin, abs_ymin, abs_xmax, abs_ymax], "score": 0.99}, ....]}
+- binary: compact fixed-width binary file of all detections plus a frame offset table, loaded with np.memmap
+	(see annotation_utils.py for the layout). Convert any other format to it with convert_annotations.py
+	when the same annotations are rendered or evaluated repeatedly
 
 
 
@@ -82,10 +94,8 @@ These formats were all established in various previous papers or common detectio
 
 For using the detection evaluation module, I recommend using yolo as ground truth format  
 and relxywh as the detection format. If using faster_rcnn results as gt, that currently entails:
-1) Convert faster rcnn output (faster) to openimages using faster_to_openimages()
-2) Convert that openimages to yolo using openimages_to_yolo()
-TODO: eliminate above conversion intermediate
-3) Convert opendatacamyolo to relxywh using opendatacamyolo_to_relxywh
+1) Convert faster rcnn output (faster) to yolo using faster_to_yolo() (or convert_annotations.py -if faster -of yolo)
+2) Convert opendatacamyolo to relxywh using opendatacamyolo_to_relxywh
 
 Currently the evaluator is erroring out with openimages or absolute ground truth annotation format.
 TODO: Figure out why this is happening. 
@@ -104,34 +114,26 @@ parser.add_argument('-i', '--input', required=True, help='path to input video')
 parser.add_argument('-a', '--annotations', required=True, help='path to annotations for video')
 parser.add_argument('-o', '--output', required=True, help='path to put output video or image at')
 parser.add_argument('-f', '--annotation_format', required=True, help='format of video annotaitons')
-parser.add_argument('-n', '--frame_num', help='number of frame to annotate (if only annotating one frame)')
+parser.add_argument('-n', '--frame_num', help='number of frame to annotate (if only annotating one frame), or a list/ranges of frames such as 10,20,100-110')
 parser.add_argument("-v", "--video", action="store_true", help='annnotate full video')
 parser.add_argument("-d", "--decomposed", action="store_true", help='output individual annotated frames for video')
-args = vars(parser.parse_args())
+parser.add_argument("-w", "--workers", type=int, default=4, help='number of threads drawing annotations when annotating a full video')
+parser.add_argument("--stride", type=int, default=1, help='preview: only annotate every k-th frame of the video')
+parser.add_argument("--start", help='preview: timestamp ([HH:]MM:SS or seconds) to start annotating the video at')
+parser.add_argument("--end", help='preview: timestamp ([HH:]MM:SS or seconds) to stop annotating the video at')
+parser.add_argument("--start_frame", type=int, help='preview: frame number to start annotating the video at')
+parser.add_argument("--end_frame", type=int, help='preview: frame number to stop annotating the video at (excluded)')
+parser.add_argument("--width", type=int, help='preview: scale the annotated video to this width')
+parser.add_argument("--timings", help='full video: save the latency of every stage (decode, resize, draw, encode, save_frames) as json to this path')
+parser.add_argument("--profile", choices=timing_utils.PROFILERS, help='full video: run under torch.profiler or cProfile')
+parser.add_argument("--profile_output", help='full video: path to write the profile to')
 
 
 
 
 
 
-def get_resolution(video):
-	""" 
-	get the width and height of video (in pixels)
-	this is important for scaling to relative or absolute
-	coordinate formats for bounding boxes
-	"""
-	(W, H) = (None, None)
-	vidcap = cv2.VideoCapture(video)
-	success,image = vidcap.read()
-	(H, W) = image.shape[:2]   
-	return (H, W)
-
-
-
-
-
-
-def annotate_frame(frame, frame_num, resolution, input_annotations, annotation_format="opendatacamyolo"):
+def annotate_frame(frame, frame_num, resolution, input_annotations, annotation_format="opendatacamyolo", scale=1.0):
 	"""
 	Returns image object representing image with bounding box superimposed
 	
@@ -139,191 +141,105 @@ def annotate_frame(frame, frame_num, resolution, input_annotations, annotation_f
 	frame_num: the number of the frame in the video (zero-indexed). This is used to find the correct
 	annotation for the frmae
 	resolution: resolution of the frame in pixels, represented by the tuple (W, H)
-	input_annotations: depending on the annotation_format parameter, this should be
-	either a folder containing a text file of annotations for each frame, or the json
-	containing annotations (see annotation_format below)
-	annotation_format: yolo (in the form outputted by opendatacam)
+	input_annotations: annotations opened once with annotation_utils.open_annotations(), or,
+	depending on the annotation_format parameter, either a folder containing a text file
+	of annotations for each frame, or the json/csv file containing annotations (see annotation_format below).
+	Passing a path parses the whole file for this one frame, so pass a store when annotating many frames
+	annotation_format: format of input_annotations if it is a path (see format specifications at top of file)
+	scale: factor the frame was resized by relative to resolution (e.g. for previews), boxes are scaled to match
 	"""
 
+	import draw_utils
+
 	(W, H) = resolution
 
-	# initialize our lists of detected bounding boxes, confidences,
-	# and class IDs, respectively
-	boxes = []
-	confidences = []
-	classIDs = []
+	#open the annotations now if we weren't handed already opened ones
+	if not hasattr(input_annotations, "get_frame"):
+		input_annotations = annotation_utils.open_annotations(input_annotations, annotation_format, resolution)
 
-	if annotation_format == "opendatacamyolo":
-	
-		
+	#slice out this frame's class IDs, confidences and abs_xmin abs_ymin abs_xmax abs_ymax boxes
+	(classIDs, confidences, boxes) = input_annotations.get_frame(frame_num)
+	if scale != 1.0:
+		boxes = boxes * scale
 
+	#draw all the boxes and their labels on the frame image at once
+	draw_utils.draw_detections(frame, boxes, classIDs.tolist(), (155, 255, 0), scores=confidences, thickness=2, font_scale=0.5)
 
-		#make sure there is [ at the beginning, a ] at the end of the file, and no extraneous comma
-		opendatacam_anns = open(input_annotations, "r").read()
-		opendatacam_anns = opendatacam_anns.replace("}, \n{", "},{")
-		final = ""
 
-		if opendatacam_anns[0] != "[":
-			final = "[" + opendatacam_anns[:-2] 
-		else:
-			final = opendatacam_anns[:-2] 
 
-		if opendatacam_anns[-2] == ",":
-			print("Fixing small formatting errors in opendatacamyolo annotations...")
-			final = final + "]"
+	return frame
 
-		frames_data = json.loads(final)
 
 
-		for frame_data in frames_data:
-			frame_id = frame_data["frame_id"]
-			if frame_id > frame_num:
-				break
-			elif frame_id < frame_num:
+def _decode_frames(cap, frame_queue, stop, start_frame=0, end_frame=None, stride=1, timer=None):
+	"""
+	decoder stage of create_annotated_video: read every stride-th frame from start_frame up to
+	(excluding) end_frame from cap and put (frame_num, frame) on the bounded frame_queue until
+	the window or video ends (or stop is set), then put None.
+	Frames in between are only grabbed, never retrieved, so they are not fully decoded
+	"""
+	import cv2
+
+	timer = timer or timing_utils.StageTimer(enabled=False)
+
+	frame_count = 0
+	if start_frame > 0:
+		cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+		frame_count = start_frame
+	try:
+		while not stop.is_set() and (end_frame is None or frame_count < end_frame):
+			if (frame_count - start_frame) % stride != 0:
+				with timer.stage("grab"):
+					grabbed = cap.grab()
+				if not grabbed:
+					break
+				frame_count += 1
 				continue
-			else:
-				detections = frame_data["objects"]
-				for detection in detections:
-					# scale the bounding box coordinates to actual image 
-					#resolution, since YOLO
-					# returns the relative center (x, y)-coordinates of
-					# the bounding box followed by the boxes' relative width and
-					# height
-					box_raw = detection["relative_coordinates"]
-					box_unscaled = (box_raw["center_x"], box_raw['center_y'], box_raw['width'], box_raw['height'])
-					box_scaled = box_unscaled * np.array([W, H, W, H])
-					(centerX, centerY, width, height) = box_scaled.astype("int")
-					
-					# use the center (x, y)-coordinates to derive the top
-					# and and left corner of the bounding box
-					x = int(centerX - (width / 2))
-					y = int(centerY - (height / 2))
-
-
-					# update our list of bounding box coordinates,
-					# confidences, and class IDs
-					boxes.append([x, y, int(width), int(height)])
-					confidences.append(float(detection["confidence"]))
-					classIDs.append(detection["class_id"])
-	elif annotation_format == "openimages":
-		annotations = open(input_annotations, "r")
-		headers = annotations.readline()
-		for line in annotations:
-			data = line.split(",")
-			image_id = int(data[0].split("frame")[1].split(".jpg")[0])
-			if image_id == frame_num:
-				xmin = int(data[4])
-				xmax = int(data[5])
-				ymin = int(data[6])
-				ymax = int(data[7])
-
-				width = xmax - xmin
-				height = ymax - ymin
-				boxes.append([xmin, ymin, width, height])
-				confidences.append(float(data[3]))
-				classIDs.append(coco_names.COCO_INSTANCE_CATEGORY_NAMES.index(data[2])) #error here?
-	elif annotation_format == "relxywh":
-		annotation_files = glob.glob(input_annotations + "/*")
-		for file in annotation_files:
-			file_frame = int(file.strip(input_annotations).strip("/frame").strip(".txt"))
-			if file_frame == frame_num:
-				print(file)
-				dets = open(file, "r")
-				for line in dets:
-					if line == "\n":
-						continue
-
-
-					data = line.split(" ")
-					print(data)
-					center_x = float(data[2]) * W 
-					center_y = float(data[3]) * H 
-					width = float(data[4]) * W
-					height = float(data[5]) * H
-
-					xmin =  center_x - (width/2)#scale it
-					ymin =  center_y - (height/2)#scale it
-					
-
-					boxes.append([xmin, ymin, width, height])
-					classIDs.append(int(data[0]))
-					confidences.append(float(data[1]))
-	elif annotation_format == "absxywh":
-		print("Abs format")
-		annotation_files = glob.glob(input_annotations + "/*")
-		for file in annotation_files:
-			file_frame = int(file.strip(input_annotations).strip("/frame").strip(".txt"))
-			if file_frame == frame_num:
-				print(file)
-				dets = open(file, "r")
-				for line in dets:
-					if line == "\n":
-						continue
-
-
-					data = line.split(" ")
-					print(data)
-
-					xmin = float(data[2])
-					ymin = float(data[3]) 
-					width = float(data[4]) 
-					height = float(data[5]) 
-
-					boxes.append([xmin, ymin, width, height])
-					classIDs.append(int(data[0]))
-					confidences.append(float(data[1]))
-	elif annotation_format == "yolo":
-		annotation_files = glob.glob(input_annotations + "/*")
-		for file in annotation_files:
-			file_frame = int(file.strip(input_annotations).strip("/frame").strip(".txt"))
-			if file_frame == frame_num:
-				print(file)
-				dets = open(file, "r")
-				for line in dets:
-					data = line.split(" ")
-					print(data)
-
-					center_x = float(data[1]) * W 
-					center_y = float(data[2]) * H 
-					width = float(data[3]) * W
-					height = float(data[4]) * H
-
-					xmin =  center_x - (width/2)
-					ymin =  center_y - (height/2)
-					
-
-					boxes.append([xmin, ymin, width, height])
-					classIDs.append(int(data[0]))
-					confidences.append(1.0) #because this is gt format
-
-					
-			
-
-	#draw all the boxes on the frame image
-	for i in range(len(boxes)):
-		# extract the bounding box coordinates
-		(x, y) = (int(boxes[i][0]), int(boxes[i][1]))
-		(w, h) = (int(boxes[i][2]), int(boxes[i][3]))
-		# draw a bounding box rectangle and label on the fram
-		param2 = (x, y)
-		param3 = (x + w, y + h)
-	
-		cv2.rectangle(frame, param2 , param3, (155, 255, 0), 2)
-		text = "{}: {:.4f}".format(classIDs[i],
-			confidences[i])
-		cv2.putText(frame, text, (x, y - 5),
-			cv2.FONT_HERSHEY_SIMPLEX, 0.5, (155, 255, 0), 2)
+			with timer.stage("decode"):
+				ret, frame = cap.read()
+			if not ret:
+				break
+			_put(frame_queue, (frame_count, frame), stop)
+			frame_count += 1
+	finally:
+		_put(frame_queue, None, stop)
 
 
 
-	return frame
+def _put(frame_queue, item, stop):
+	#block while the queue is full, but give up if the consumer stopped
+	while not stop.is_set():
+		try:
+			frame_queue.put(item, timeout=0.1)
+			return
+		except queue.Full:
+			continue
+
+
 
+def _resize_and_annotate(frame, frame_num, resolution, annotations, annotation_format, out_resolution, timer):
+	import cv2
 
+	#downscale the frame first, so drawing happens at the (smaller) output resolution
+	scale = out_resolution[0] / resolution[0]
+	if out_resolution != resolution:
+		with timer.stage("resize"):
+			frame = cv2.resize(frame, out_resolution, interpolation=cv2.INTER_AREA)
+	with timer.stage("draw"):
+		return annotate_frame(frame, frame_num, resolution, annotations, annotation_format, scale)
 
-def create_annotated_video(input_video, input_annotations, out_video_name, annotation_format="yolo", output_frames=False):
+
+
+def create_annotated_video(input_video, input_annotations, out_video_name, annotation_format="yolo", output_frames=False,
+	workers=4, queue_depth=16, stride=1, start_frame=0, end_frame=None, target_width=None, timer=None):
 	"""
 	Generate annotated version of input video (i.e., superimpose all bounding boxes)
 
+	Runs as a pipeline: a decoder thread reads frames into a bounded queue, a pool of
+	workers threads draws on them, and this thread encodes (and optionally saves) the annotated
+	frames in order. OpenCV releases the GIL, so decoding, drawing and encoding overlap, and
+	at most about 2 * queue_depth frames are in memory at once.
+
 	input_video: video containing frame to annotate
 	input_annotations: depending on the annotation_format parameter, this should be
 	either a folder containing a text file of annotations for each frame, or the json
@@ -331,118 +247,254 @@ def create_annotated_video(input_video, input_annotations, out_video_name, annot
 	out_video_name: desired name for output video
 	annotation_format: format of annotations (see format specifications at top of file)
 	output_frames: If true, will generate a folder out_video_name/ containing each annotated frame
+	workers: number of drawing threads
+	queue_depth: maximum number of decoded frames waiting to be drawn, and of frames being drawn
+
+	Preview options, for quickly checking annotations on long videos:
+	stride: only annotate every stride-th frame
+	start_frame, end_frame: only annotate frames start_frame up to (excluding) end_frame.
+	The video is seeked to start_frame, and skipped frames are grabbed without being retrieved
+	target_width: scale the output (and the boxes) to this width, keeping the aspect ratio
+
+	timer: optional timing_utils.StageTimer recording the latency of the grab, decode, resize,
+	draw, encode and save_frames stages of every frame
+
+	Returns (number of frames annotated, achieved frames per second)
 	"""
+	import cv2
+
+	timer = timer or timing_utils.StageTimer(enabled=False)
 
 	#if output_frames is True, make directory to hold annoated frames
-	dir_exists = os.path.isdir(out_video_name + "/") 
-	if dir_exists:
-		#delete and recreate
-		os.system("rm -r " + out_video_name)
-		os.system("mkdir " + out_video_name)
-	else:
-		#just create
-		os.system("mkdir " + out_video_name)
+	if output_frames:
+		if os.path.isdir(out_video_name):
+			#delete and recreate
+			shutil.rmtree(out_video_name)
+		os.makedirs(out_video_name)
 
 
 	cap = cv2.VideoCapture(input_video)
 	if (cap.isOpened() == False):
 	    print('Error while trying to read video. Please check path again')
-	# get the frame width and height
-	frame_width = int(cap.get(3))
-	frame_height = int(cap.get(4))
+	# get the frame width, height and fps from the (cached) container metadata
+	metadata = probe_video(input_video)
+	frame_width = metadata["width"]
+	frame_height = metadata["height"]
 	resolution = (frame_width, frame_height)
+	out_resolution = resolution
+	if target_width is not None and target_width != frame_width:
+		out_resolution = (int(target_width), int(round(frame_height * target_width / frame_width)))
 	
 	# define codec and create VideoWriter object 
+	# (a preview of every stride-th frame plays at the matching lower frame rate, keeping the video's duration)
 	out = cv2.VideoWriter(out_video_name + ".mp4", 
-	                      cv2.VideoWriter_fourcc(*'mp4v'), 30, 
-	                      resolution)
+	                      cv2.VideoWriter_fourcc(*'mp4v'), (metadata["fps"] or 30) / max(1, stride), 
+	                      out_resolution)
 	frame_count = 0
 
-	# read until end of video
-	while(cap.isOpened()):
-	    # capture each frame of the video
-	    ret, frame = cap.read()
-	    if ret == True:
-	    	#annotate 
-	    	image = annotate_frame(frame, frame_count, resolution, input_annotations, annotation_format)
-	    	frame_count += 1
-	    	out.write(image)
+	#open the annotations once for the whole video (folder formats are indexed once and read lazily)
+	annotations = annotation_utils.open_annotations(input_annotations, annotation_format, resolution)
+
+	start_time = time.time()
+	frame_queue = queue.Queue(maxsize=queue_depth)
+	stop = threading.Event()
+	decoder = threading.Thread(target=_decode_frames, args=(cap, frame_queue, stop, start_frame, end_frame, max(1, stride), timer), daemon=True)
+	decoder.start()
+
+	def write(image):
+		with timer.stage("encode"):
+			out.write(image)
+		if output_frames:
+			#save the output image
+			with timer.stage("save_frames"):
+				cv2.imwrite(out_video_name + "/annotated-frame%d.jpg" % frame_count, image)
+
+	try:
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			#frames being drawn, oldest first, so they are encoded in their original order
+			pending = deque()
+			while True:
+				item = frame_queue.get()
+				if item is None:
+					break
+				(frame_num, frame) = item
+				pending.append(pool.submit(_resize_and_annotate, frame, frame_num, resolution, annotations, annotation_format, out_resolution, timer))
+				if len(pending) >= queue_depth:
+					image = pending.popleft().result()
+					frame_count += 1
+					write(image)
+
+			while pending:
+				image = pending.popleft().result()
+				frame_count += 1
+				write(image)
+	finally:
+		stop.set()
+		decoder.join()
+		# release VideoCapture() and VideoWriter()
+		cap.release()
+		out.release()
+
+	elapsed = time.time() - start_time
+	fps = frame_count / elapsed if elapsed > 0 else 0.0
+	return (frame_count, fps)
 
-	    	if output_frames:
-	    		#save the output image
-	    		cv2.imwrite(out_video_name + "/annotated-frame%d.jpg" % frame_count, image)
-	    else:
-	        break
 
-	# release VideoCapture()
-	cap.release()
-	# close all frames and video windows
-	cv2.destroyAllWindows()
 
+#create_annotated_video("videos/inria.mp4", "inria-annotations2", "annotated_inria", "yolo", True)
 
 
-#create_annotated_video("videos/inria.mp4", "inria-annotations2", "annotated_inria", "yolo", True)
+
+def parse_timestamp(timestamp):
+	"""parse a timestamp given in seconds (e.g. 90 or 90.5) or as [HH:]MM:SS[.ms] (e.g. 1:30) into seconds"""
+	seconds = 0.0
+	for part in str(timestamp).split(":"):
+		seconds = seconds * 60 + float(part)
+	return seconds
 
 
 
-def draw_annotated_frame(input_video, input_annotations, target_frame, output_name, annotation_format="opendatacam_yolo"):
+def parse_frame_numbers(frame_nums):
 	"""
-	draw bounding boxes on target_frame
+	parse a frame number specification such as "622" or "10,20,100-110"
+	(comma separated frame numbers and inclusive ranges) into a sorted list of unique frame numbers
+	"""
+	frames = set()
+	for part in str(frame_nums).split(","):
+		part = part.strip()
+		if part == "":
+			continue
+		if "-" in part:
+			(first, last) = part.split("-")
+			frames.update(range(int(first), int(last) + 1))
+		else:
+			frames.add(int(part))
+	return sorted(frames)
 
-	input_video: video containing frame to annotate
-	input_annotations: depending on the annotation_format parameter, this should be
-	either a folder containing a text file of annotations for each frame, or the json
-	containing annotations (see annotation_format below)
-	target_frame: the number of the frame (0-indexed) to annotate
-	annotation_format: format of annotations (see format specifications at top of file)
+
+
+def _seek(vidcap, target_frame):
 	"""
+	position vidcap so that the next read() returns target_frame
+	(the container seeks to the nearest keyframe before target_frame and decodes forward from there)
+	"""
+	import cv2
 
-	(W, H) = (None, None)
+	vidcap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
 
 
-	#extract specific frame
-	vidcap = cv2.VideoCapture(input_video)
-	success,image = vidcap.read()
-	count = 0
-	frame = None
-	while success:
-	  if count == target_frame:
-		  (H, W) = image.shape[:2]   
-		  print("H, W")
-		  print((H, W))
-		  frame = image
-		  break
-		 
-	  success,image = vidcap.read()
-	  # print('Read a new frame: ', success)
-	  count += 1
 
-	resolution = (W, H)
+def _should_seek(position, target_frame, keyframes, seek_threshold):
+	"""
+	whether seeking is cheaper than decoding forward from position to target_frame:
+	with known keyframe positions, seek exactly when a keyframe lies between the two,
+	otherwise when target_frame is more than seek_threshold frames ahead
+	"""
+	if keyframes:
+		i = bisect.bisect_right(keyframes, target_frame) - 1
+		return i >= 0 and keyframes[i] > position
+	return target_frame - position > seek_threshold
 
-	#pass extracted frame to annotate_frame to be drawn on
-	annotated_frame = annotate_frame(frame, target_frame, resolution, input_annotations, annotation_format)
 
-	#save the output image
-	cv2.imwrite(output_name + ".jpg", annotated_frame)
 
+def draw_annotated_frame(input_video, input_annotations, target_frame, output_name, annotation_format="opendatacam_yolo",
+	seek_threshold=120):
+	"""
+	draw bounding boxes on target_frame
 
+	input_video: video containing frame to annotate
+	input_annotations: depending on the annotation_format parameter, this should be
+	either a folder containing a text file of annotations for each frame, or the json
+	containing annotations (see annotation_format below)
+	target_frame: the number of the frame (0-indexed) to annotate, or a list of frame numbers.
+	A single frame is written to output_name.jpg. For a list, the frames are sorted and all rendered
+	in one forward pass over the video, each written to output_name-frame<N>.jpg
+	annotation_format: format of annotations (see format specifications at top of file)
+	seek_threshold: if the video's keyframe positions are unknown, seek to the next target frame when it
+	is more than this many frames ahead instead of decoding every frame in between
+	"""
+	import cv2
 
+	batch = isinstance(target_frame, (list, tuple, range))
+	target_frames = sorted(set(target_frame)) if batch else [target_frame]
 
-#draw_annotated_frame("videos/inria.mp4", "inria-annotations2", 622, "yolo")
+	vidcap = cv2.VideoCapture(input_video)
+	metadata = probe_video(input_video)
+	resolution = (metadata["width"], metadata["height"])
+
+	#open the annotations once for all target frames
+	annotations = annotation_utils.open_annotations(input_annotations, annotation_format, resolution)
+
+	#number of the frame the next read() returns
+	position = 0
+	for frame_num in target_frames:
+		if _should_seek(position, frame_num, metadata["keyframes"], seek_threshold):
+			_seek(vidcap, frame_num)
+			position = frame_num
+		else:
+			#close enough, skip ahead without retrieving the skipped frames
+			while position < frame_num and vidcap.grab():
+				position += 1
+
+		success, frame = vidcap.read()
+		if not success:
+			print("Frame " + str(frame_num) + " is past the end of the video")
+			break
+		position += 1
+
+		#pass extracted frame to annotate_frame to be drawn on
+		annotated_frame = annotate_frame(frame, frame_num, resolution, annotations, annotation_format)
+
+		#save the output image
+		if batch:
+			cv2.imwrite(output_name + "-frame%d.jpg" % frame_num, annotated_frame)
+		else:
+			cv2.imwrite(output_name + ".jpg", annotated_frame)
 
+	vidcap.release()
 
 
-if args['video']:
-	print("yo")
-	create_annotated_video(args["input"], args["annotations"], args["output"], args["annotation_format"], args["decomposed"])
-else:
-	print('hi')
-	draw_annotated_frame(args["input"], args["annotations"], int(args["frame_num"]), args["output"], args["annotation_format"])
 
 
+#draw_annotated_frame("videos/inria.mp4", "inria-annotations2", 622, "yolo")
 
 
 
+def main(argv=None):
+	"""
+	driver code: annotate a full video (-v) or the frame(s) given by -n, according to the
+	command line args (argv, by default sys.argv[1:])
+	"""
+	args = vars(parser.parse_args(argv))
+
+	if args['video']:
+		print("yo")
+		#convert the preview window to frame numbers
+		start_frame = args["start_frame"] or 0
+		end_frame = args["end_frame"]
+		if args["start"] is not None or args["end"] is not None:
+			video_fps = probe_video(args["input"])["fps"]
+			if args["start"] is not None:
+				start_frame = int(round(parse_timestamp(args["start"]) * video_fps))
+			if args["end"] is not None:
+				end_frame = int(round(parse_timestamp(args["end"]) * video_fps))
+
+		timer = timing_utils.StageTimer(enabled=args["timings"] is not None)
+		with timing_utils.profiling(args["profile"], args["profile_output"]):
+			(frame_count, fps) = create_annotated_video(args["input"], args["annotations"], args["output"], args["annotation_format"], args["decomposed"],
+				args["workers"], stride=args["stride"], start_frame=start_frame, end_frame=end_frame, target_width=args["width"], timer=timer)
+		print("Annotated " + str(frame_count) + " frames at " + str(round(fps, 2)) + " frames per second")
+		if args["timings"] is not None:
+			timer.save(args["timings"], input=args["input"], frames=frame_count, workers=args["workers"])
+			print(timer.format())
+	else:
+		print('hi')
+		target_frames = parse_frame_numbers(args["frame_num"])
+		if len(target_frames) == 1 and args["frame_num"].strip().isdigit():
+			target_frames = target_frames[0]
+		draw_annotated_frame(args["input"], args["annotations"], target_frames, args["output"], args["annotation_format"])
 
 
 
+if __name__ == "__main__":
+	sys.exit(main())